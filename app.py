@@ -1,31 +1,30 @@
 
 import streamlit as st
+import pandas as pd
 import csv
+import importlib
 import os
-import re
 import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from io import StringIO
+from queue import Empty, Queue
+from io import BytesIO, StringIO
 from dotenv import load_dotenv
 
-# Force reload of email_scraper module to ensure latest code is loaded
-if 'email_scraper' in sys.modules:
-    import importlib
-    import email_scraper
-    importlib.reload(email_scraper)
-    from email_scraper import (
-        BrightdataClient,
-        SupabaseClient,
-        EmailScraperEngine,
-        logger
-    )
-else:
-    from email_scraper import (
-        BrightdataClient,
-        SupabaseClient,
-        EmailScraperEngine,
-        logger
-    )
+# Opt-in hot reload of email_scraper while developing (set DEV_HOT_RELOAD=1);
+# otherwise the module is imported once and reused across Streamlit reruns
+if os.getenv('DEV_HOT_RELOAD') and 'email_scraper' in sys.modules:
+    importlib.reload(sys.modules['email_scraper'])
+
+from email_scraper import (
+    BrightdataClient,
+    SupabaseClient,
+    EmailScraperEngine,
+    extract_emails_from_json,
+    logger
+)
 
 # Load environment variables from project-local .env reliably
 env_path = Path(__file__).resolve().parent / ".env"
@@ -35,6 +34,15 @@ else:
     # Fallback to cwd search
     load_dotenv()
 
+# Max concurrent Brightdata/Supabase requests per stage (network-bound work)
+FETCH_WORKERS = 16
+
+# Rows per Stage 4 request; the fetch status is refreshed once per page
+STAGE4_PAGE_SIZE = 1000
+
+# Log line prefix by save_email error_type ('' means saved)
+LOG_PREFIX = {'': '✅ ', 'duplicate': 'ℹ️ ', 'error': '❌ '}
+
 # Page Configuration
 st.set_page_config(
     page_title="Email Scraper",
@@ -77,6 +85,55 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
+class LogBuffer:
+    """
+    Rolling log rendered into a single Streamlit placeholder
+    
+    Lines are buffered and the placeholder is only redrawn every flush_every
+    lines (and on flush()), instead of one websocket update per line.
+    """
+    
+    def __init__(self, placeholder, max_lines: int = 20, flush_every: int = 25):
+        self.placeholder = placeholder
+        self.lines = deque(maxlen=max_lines)
+        self.flush_every = flush_every
+        self.pending = 0
+    
+    def append(self, line: str):
+        """Add a line, redrawing the placeholder every flush_every lines"""
+        self.lines.append(line)
+        self.pending += 1
+        if self.pending >= self.flush_every:
+            self.flush()
+    
+    def flush(self):
+        """Redraw the placeholder with the most recent lines"""
+        if self.pending:
+            self.placeholder.code('\n'.join(self.lines), language=None)
+            self.pending = 0
+
+
+class UiThrottle:
+    """
+    Rate limiter for per-item Streamlit widget updates
+    
+    Loops call ready() before redrawing progress/status widgets so they are
+    updated at most once per interval (~10 Hz) instead of once per item.
+    """
+    
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.last_update = 0.0
+    
+    def ready(self) -> bool:
+        """Return True (and reset the timer) if the interval has elapsed"""
+        now = time.monotonic()
+        if now - self.last_update >= self.interval:
+            self.last_update = now
+            return True
+        return False
+
+
 def initialize_session_state():
     """Initialize Streamlit session state"""
     if 'queries_loaded' not in st.session_state:
@@ -86,6 +143,11 @@ def initialize_session_state():
         st.session_state.processing_complete = False
         st.session_state.results = None
         st.session_state.stage2_results = None
+    
+    if 'unmarked_ids' not in st.session_state:
+        # Snapshot IDs whose response was saved this session but could not be
+        # marked processed; Stage 2 retries the mark instead of re-fetching them
+        st.session_state.unmarked_ids = set()
 
 
 def validate_environment():
@@ -104,6 +166,65 @@ def validate_environment():
     return True, "All environment variables configured"
 
 
+@st.cache_resource(show_spinner=False)
+def get_supabase_client() -> SupabaseClient:
+    """
+    Get a Supabase client shared across reruns and sessions
+    
+    Returns:
+        SupabaseClient built from SUPABASE_URL/SUPABASE_KEY
+    """
+    supabase_url = os.getenv('SUPABASE_URL') or ""
+    supabase_key = os.getenv('SUPABASE_KEY') or ""
+    return SupabaseClient(supabase_url, supabase_key)
+
+
+def get_clients(api_key: str) -> tuple:
+    """
+    Get Brightdata and Supabase clients
+    
+    The Brightdata client is cached in session state and rebuilt only when
+    the API key changes; the Supabase client is the shared cached resource.
+    
+    Args:
+        api_key: Bright Data API key
+        
+    Returns:
+        Tuple of (BrightdataClient, SupabaseClient)
+    """
+    cached = st.session_state.get('clients')
+    
+    if cached is None or cached[0] != api_key:
+        brightdata_url = os.getenv('BRIGHTDATA_URL') or ""
+        cached = (api_key, BrightdataClient(api_key, brightdata_url))
+        st.session_state.clients = cached
+    
+    return cached[1], get_supabase_client()
+
+
+def iter_csv_queries(uploaded_file, chunksize: int = 10000):
+    """
+    Stream queries from uploaded CSV file
+    
+    Args:
+        uploaded_file: Streamlit uploaded file object
+        chunksize: Number of rows parsed per chunk
+        
+    Yields:
+        Non-empty, stripped queries from the first column
+    """
+    try:
+        # Parse with pandas' C reader: header row skipped, first column only
+        uploaded_file.seek(0)
+        chunks = pd.read_csv(uploaded_file, header=0, usecols=[0], dtype=str, na_filter=False, encoding="utf8", chunksize=chunksize)
+        
+        for chunk in chunks:
+            queries = chunk.iloc[:, 0].str.strip()
+            yield from queries[queries != '']
+    except Exception as e:
+        st.error(f"Error reading CSV file: {str(e)}")
+
+
 def load_csv_queries(uploaded_file) -> list:
     """
     Load queries from uploaded CSV file
@@ -114,52 +235,55 @@ def load_csv_queries(uploaded_file) -> list:
     Returns:
         List of queries from the first column
     """
-    try:
-        stringio = StringIO(uploaded_file.getvalue().decode("utf8"))
-        csv_reader = csv.reader(stringio)
-        
-        # Skip header
-        next(csv_reader)
-        
-        queries = []
-        for row in csv_reader:
-            if row and len(row) > 0:
-                query = row[0].strip()
-                if query:
-                    queries.append(query)
+    return list(iter_csv_queries(uploaded_file))
+
+
+@st.cache_data(show_spinner=False)
+def summarize_csv_queries(file_bytes: bytes, preview_size: int = 20) -> tuple:
+    """
+    Count queries and take the preview in one pass, cached per file content
+    
+    Args:
+        file_bytes: Raw content of the uploaded CSV file
+        preview_size: Number of leading queries kept for the preview
         
-        return queries
-    except Exception as e:
-        st.error(f"Error reading CSV file: {str(e)}")
-        return []
+    Returns:
+        Tuple of (total query count, first preview_size queries)
+    """
+    total_queries = 0
+    preview_queries = []
+    for query in iter_csv_queries(BytesIO(file_bytes)):
+        if total_queries < preview_size:
+            preview_queries.append(query)
+        total_queries += 1
+    return total_queries, preview_queries
 
 
-def filter_queries(uploaded_queries: list, existing_queries: list) -> dict:
+def filter_queries(uploaded_queries: list, existing_queries: set) -> dict:
     """
     Filter queries by comparing against existing database queries
     
     Args:
         uploaded_queries: List of queries from CSV
-        existing_queries: List of existing queries from database (lowercase)
+        existing_queries: Set of existing queries from database (casefolded)
         
     Returns:
         Dictionary with filtered results
     """
-    # Remove duplicates from uploaded queries (case-insensitive)
-    unique_queries = []
-    seen = set()
+    # Remove duplicates from uploaded queries (casefolded), keeping the
+    # first original spelling in insertion order
+    unique_queries: dict[str, str] = {}
     for query in uploaded_queries:
-        query_lower = query.lower().strip()
-        if query_lower and query_lower not in seen:
-            unique_queries.append(query)
-            seen.add(query_lower)
+        query = query.strip()
+        query_lower = query.casefold()
+        if query_lower and query_lower not in unique_queries:
+            unique_queries[query_lower] = query
     
     # Split into new vs existing
     new_queries = []
     existing_in_db = []
     
-    for query in unique_queries:
-        query_lower = query.lower().strip()
+    for query_lower, query in unique_queries.items():
         if query_lower in existing_queries:
             existing_in_db.append(query)
         else:
@@ -176,6 +300,46 @@ def filter_queries(uploaded_queries: list, existing_queries: list) -> dict:
     }
 
 
+@st.cache_data(ttl=300, show_spinner=False)
+def cached_existing_queries(supabase_url: str, supabase_key: str, candidates: tuple) -> frozenset:
+    """
+    Look up which uploaded queries already exist, cached across Streamlit reruns
+    
+    Args:
+        supabase_url: Supabase project URL (part of the cache key)
+        supabase_key: Supabase API key (part of the cache key)
+        candidates: Uploaded queries to check
+        
+    Returns:
+        Frozen set of casefolded candidate queries found in snapshot_table
+        
+    Raises:
+        RuntimeError: If the lookup failed (raised so the failure is not cached)
+    """
+    existing = get_supabase_client().find_existing_queries(list(candidates))
+    if existing is None:
+        raise RuntimeError("Existing query lookup failed")
+    return frozenset(existing)
+
+
+@st.cache_data(show_spinner=False)
+def new_queries_csv(queries: tuple) -> bytes:
+    """
+    Build the filtered CSV download once per unique set of new queries
+    
+    Args:
+        queries: New queries to write, in order
+        
+    Returns:
+        UTF-8 encoded CSV with a single "Query" column
+    """
+    csv_output = StringIO()
+    csv_writer = csv.writer(csv_output)
+    csv_writer.writerow(['Query'])
+    csv_writer.writerows([query] for query in queries)
+    return csv_output.getvalue().encode('utf-8')
+
+
 def display_stage0_tab():
     """Display Stage 0 tab for filtering queries"""
     st.header("🔍 Stage 0: Filter Queries")
@@ -209,12 +373,18 @@ def display_stage0_tab():
             st.error("❌ Database configuration missing. Please check .env file.")
             return
         
+        if st.button("🔄 Refresh Existing Queries", key="stage0_refresh", help="Reload existing queries from the database"):
+            cached_existing_queries.clear()
+        
         try:
-            supabase_client = SupabaseClient(supabase_url, supabase_key)
-            
             with st.spinner("🔍 Checking queries against database..."):
-                # Get existing queries from database
-                existing_queries = supabase_client.get_all_existing_queries()
+                # Match uploaded queries in the database (lowercase set for O(1) lookups, cached for 5 minutes)
+                try:
+                    existing_queries = cached_existing_queries(supabase_url, supabase_key, tuple(uploaded_queries))
+                except RuntimeError:
+                    # Filtering against an unknown set would pass every query as new
+                    st.error("❌ Could not check queries against the database. Nothing was filtered; please try again.")
+                    return
                 
                 # Filter queries
                 result = filter_queries(uploaded_queries, existing_queries)
@@ -282,14 +452,8 @@ def display_stage0_tab():
             st.subheader("📥 Download Filtered CSV")
             
             if result['new_queries']:
-                # Create CSV for download
-                csv_output = StringIO()
-                csv_writer = csv.writer(csv_output)
-                csv_writer.writerow(['Query'])
-                for query in result['new_queries']:
-                    csv_writer.writerow([query])
-                
-                csv_data = csv_output.getvalue()
+                # Create CSV for download (cached across reruns)
+                csv_data = new_queries_csv(tuple(result['new_queries']))
                 
                 st.download_button(
                     label=f"📥 Download Filtered CSV ({len(result['new_queries'])} queries)",
@@ -395,34 +559,32 @@ def display_upload_section():
     return uploaded_file
 
 
-def display_queries_preview(queries):
-    """Display preview of loaded queries"""
+def display_queries_preview(total_queries: int, preview_queries: list):
+    """
+    Display preview of loaded queries
+    
+    Args:
+        total_queries: Number of queries in the uploaded file
+        preview_queries: First queries of the file (at most 20 are shown)
+    """
     st.subheader("📋 Loaded Queries")
     
     col1, col2, col3 = st.columns(3)
     with col1:
-        st.metric("Total Queries", len(queries))
+        st.metric("Total Queries", total_queries)
     with col2:
-        st.metric("Batches (÷2)", (len(queries) + 1) // 2)
+        st.metric("Batches (÷2)", (total_queries + 1) // 2)
     with col3:
-        st.metric("API Requests", (len(queries) + 1) // 2)
+        st.metric("API Requests", (total_queries + 1) // 2)
     
     # Show preview
     with st.expander("👁️ Preview Queries", expanded=False):
-        preview_cols = st.columns([1, 4])
+        preview_df = pd.DataFrame({'Query': preview_queries[:20]})
+        preview_df.index = preview_df.index + 1
+        st.dataframe(preview_df, use_container_width=True)
         
-        with preview_cols[0]:
-            st.write("**#**")
-            for i in range(1, min(len(queries) + 1, 21)):
-                st.write(i)
-        
-        with preview_cols[1]:
-            st.write("**Query**")
-            for query in queries[:20]:
-                st.write(query)
-        
-        if len(queries) > 20:
-            st.info(f"... and {len(queries) - 20} more queries")
+        if total_queries > 20:
+            st.info(f"... and {total_queries - 20} more queries")
 
 
 def display_processing_section():
@@ -457,13 +619,8 @@ def process_queries(queries):
             st.error("Please enter Bright Data API Key in the sidebar")
             return None
         
-        # Initialize clients
-        brightdata_url = os.getenv('BRIGHTDATA_URL') or ""
-        supabase_url = os.getenv('SUPABASE_URL') or ""
-        supabase_key = os.getenv('SUPABASE_KEY') or ""
-        
-        brightdata_client = BrightdataClient(api_key, brightdata_url)
-        supabase_client = SupabaseClient(supabase_url, supabase_key)
+        # Reuse clients cached in session state
+        brightdata_client, supabase_client = get_clients(api_key)
         
         # Create engine and process
         engine = EmailScraperEngine(brightdata_client, supabase_client)
@@ -474,7 +631,11 @@ def process_queries(queries):
         
         # Process queries with batch size from session state
         batch_size = st.session_state.get('batch_size', 2)
-        stats = engine.process_queries(queries, batch_size)
+        stats = engine.process_queries(
+            queries,
+            batch_size,
+            progress_callback=lambda done, total: progress_bar.progress(done / total)
+        )
         
         progress_bar.progress(1.0)
         status_text.text("Processing complete!")
@@ -505,13 +666,8 @@ def process_automated_pipeline(queries):
             st.error("Please enter Bright Data API Key in the sidebar")
             return None
         
-        # Initialize clients
-        brightdata_url = os.getenv('BRIGHTDATA_URL') or ""
-        supabase_url = os.getenv('SUPABASE_URL') or ""
-        supabase_key = os.getenv('SUPABASE_KEY') or ""
-        
-        brightdata_client = BrightdataClient(api_key, brightdata_url)
-        supabase_client = SupabaseClient(supabase_url, supabase_key)
+        # Reuse clients cached in session state
+        brightdata_client, supabase_client = get_clients(api_key)
         
         # ============================================
         # STAGE 1: Upload & Process Queries
@@ -524,7 +680,11 @@ def process_automated_pipeline(queries):
         batch_size = st.session_state.get('batch_size', 2)
         
         stage1_status.info(f"📤 Uploading {len(queries)} queries in batches of {batch_size}...")
-        stats_stage1 = engine.process_queries(queries, batch_size)
+        stats_stage1 = engine.process_queries(
+            queries,
+            batch_size,
+            progress_callback=lambda done, total: stage1_progress.progress(done / total)
+        )
         
         stage1_progress.progress(1.0)
         
@@ -541,36 +701,50 @@ def process_automated_pipeline(queries):
         polling_status = st.empty()
         polling_progress = st.empty()
         
-        MAX_POLL_ATTEMPTS = 20  # 20 attempts × 30 sec = 10 minutes max
-        POLL_INTERVAL = 30  # 30 seconds
+        MAX_POLL_ATTEMPTS = 15  # 2, 4, 8, 16, 32, then 60 sec steps ≈ 10 minutes max
+        MAX_POLL_DELAY = 60  # 60 seconds
+        READY_THRESHOLD = 0.8  # Start Stage 2 once 80% of this run's snapshots are ready
         poll_attempt = 0
+        poll_elapsed = 0
+        data_ready = False
+        ready_results = {}  # snapshot_id -> get_snapshot_data() result, reused by Stage 2
+        # Only the snapshots Stage 1 just created count; stale ones from earlier
+        # runs that never become ready must not hold this run back
+        submitted_ids = stats_stage1['submitted_ids']
         
-        polling_status.info(f"⏱️ Polling every {POLL_INTERVAL} seconds (max {MAX_POLL_ATTEMPTS} attempts)...")
+        polling_status.info(f"⏱️ Polling with exponential backoff (2 to {MAX_POLL_DELAY} seconds, max {MAX_POLL_ATTEMPTS} attempts)...")
         
         while poll_attempt < MAX_POLL_ATTEMPTS:
             poll_attempt += 1
             polling_progress.progress(poll_attempt / MAX_POLL_ATTEMPTS)
             
-            # Check if any snapshots are ready
-            unprocessed = supabase_client.get_unprocessed_snapshots()
-            
-            if unprocessed:
-                # Try to retrieve at least one snapshot to check if ready
-                test_snapshot = unprocessed[0]['snapshot_id']
-                data, is_running, is_valid, error_reason = brightdata_client.get_snapshot_data(test_snapshot)
-                
-                if is_valid:
-                    polling_status.success(f"✅ Data ready after {poll_attempt} attempts ({poll_attempt * POLL_INTERVAL} seconds)")
-                    break
-                else:
-                    polling_status.info(f"⏳ Attempt {poll_attempt}/{MAX_POLL_ATTEMPTS}: Data not ready yet ({error_reason})...")
+            # Check readiness of the submitted snapshots not already known to be ready, concurrently
+            pending = [snapshot_id for snapshot_id in submitted_ids if snapshot_id not in ready_results]
+            with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+                checks = list(executor.map(brightdata_client.get_snapshot_data, pending))
+            error_reason = None
+            for snapshot_id, check in zip(pending, checks):
+                if check[2]:
+                    ready_results[snapshot_id] = check
+                elif error_reason is None:
+                    error_reason = check[3]
+            ready_count = len(ready_results)
+            
+            if ready_count / len(submitted_ids) >= READY_THRESHOLD:
+                data_ready = True
+                polling_status.success(f"✅ Data ready after {poll_attempt} attempts ({poll_elapsed} seconds): {ready_count}/{len(submitted_ids)} snapshots ready")
+                break
+            else:
+                polling_status.info(f"⏳ Attempt {poll_attempt}/{MAX_POLL_ATTEMPTS}: {ready_count}/{len(submitted_ids)} snapshots ready ({error_reason})...")
             
             if poll_attempt < MAX_POLL_ATTEMPTS:
-                import time
-                time.sleep(POLL_INTERVAL)
+                # Exponential backoff: detect fast jobs quickly, go easy on the API for slow ones
+                poll_delay = min(MAX_POLL_DELAY, 2 ** poll_attempt)
+                time.sleep(poll_delay)
+                poll_elapsed += poll_delay
         
-        if poll_attempt >= MAX_POLL_ATTEMPTS:
-            st.warning(f"⚠️ Polling timeout after {MAX_POLL_ATTEMPTS * POLL_INTERVAL} seconds. Proceeding with available data...")
+        if not data_ready:
+            st.warning(f"⚠️ Polling timeout after {poll_elapsed} seconds. Proceeding with available data...")
         
         # ============================================
         # STAGE 2: Retrieve Data
@@ -578,10 +752,11 @@ def process_automated_pipeline(queries):
         st.info("🚀 **STAGE 2: Retrieving data from Brightdata...**")
         stage2_status = st.empty()
         stage2_progress = st.progress(0)
-        stage2_log = st.empty()
+        stage2_log = LogBuffer(st.empty())
         
-        # Get unprocessed snapshots
-        snapshots = supabase_client.get_unprocessed_snapshots()
+        # Get unprocessed snapshots, marking ones whose response was already
+        # saved instead of fetching them again
+        snapshots = mark_saved_snapshots(supabase_client, supabase_client.get_unprocessed_snapshots())
         total_snapshots = len(snapshots)
         
         if total_snapshots == 0:
@@ -596,52 +771,83 @@ def process_automated_pipeline(queries):
             skipped = 0
             invalid_responses = 0
             
-            for idx, snapshot_data in enumerate(snapshots):
-                snapshot_id = snapshot_data.get('snapshot_id')
-                queries_list = snapshot_data.get('query', [])
-                
-                # Update progress
-                progress = (idx + 1) / total_snapshots
-                stage2_progress.progress(progress)
-                stage2_status.info(f"📥 Processing snapshot {idx + 1}/{total_snapshots}: {snapshot_id}")
-                
-                try:
-                    # Retrieve snapshot data
-                    data, is_running, is_valid, error_reason = brightdata_client.get_snapshot_data(snapshot_id)
-                    
-                    if not is_valid:
-                        invalid_responses += 1
-                        stage2_log.warning(f"⚠️ [{idx+1}/{total_snapshots}] Invalid response: {snapshot_id} - {error_reason}")
-                        continue  # Skip invalid, will retry later
+            # Snapshot IDs saved (or already saved) but not yet marked processed;
+            # flushed with one bulk update every MARK_BATCH_SIZE IDs
+            MARK_BATCH_SIZE = 50
+            pending_marks = []
+            
+            def flush_marks():
+                if pending_marks and not supabase_client.mark_as_processed_bulk(pending_marks):
+                    # Saved but unmarked: the next run retries the mark without re-fetching
+                    st.session_state.unmarked_ids.update(pending_marks)
+                    stage2_log.append(f"❌ Failed to mark {len(pending_marks)} snapshots as processed")
+                pending_marks.clear()
+            
+            try:
+                # Fetch snapshots concurrently; save results on the main thread.
+                # Snapshots already found ready while polling reuse that result
+                # as a pre-completed future instead of being fetched again.
+                with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+                    futures = {}
+                    for s in snapshots:
+                        snapshot_id = s.get('snapshot_id')
+                        if snapshot_id in ready_results:
+                            future = Future()
+                            future.set_result(ready_results.pop(snapshot_id))
+                        else:
+                            future = executor.submit(brightdata_client.get_snapshot_data, snapshot_id)
+                        futures[future] = snapshot_id
                     
-                    if data:
-                        # Save to response_table
-                        save_success, error_type = supabase_client.save_response(snapshot_id, data)
+                    ui_throttle = UiThrottle()
+                    for idx, future in enumerate(as_completed(futures)):
+                        snapshot_id = futures[future]
                         
-                        if save_success:
-                            # Mark as processed
-                            supabase_client.mark_as_processed(snapshot_id)
-                            successful += 1
-                            stage2_log.success(f"✅ [{idx+1}/{total_snapshots}] Saved: {snapshot_id}")
-                        elif error_type == 'duplicate':
-                            # Already exists, mark as processed
-                            supabase_client.mark_as_processed(snapshot_id)
-                            skipped += 1
-                            stage2_log.info(f"ℹ️ [{idx+1}/{total_snapshots}] Duplicate: {snapshot_id}")
-                        else:
+                        # Update progress (throttled)
+                        if ui_throttle.ready():
+                            stage2_progress.progress((idx + 1) / total_snapshots)
+                            stage2_status.info(f"📥 Processing snapshot {idx + 1}/{total_snapshots}: {snapshot_id}")
+                        
+                        try:
+                            # Retrieve snapshot data
+                            data, is_running, is_valid, error_reason = future.result()
+                            
+                            if not is_valid:
+                                invalid_responses += 1
+                                stage2_log.append(f"⚠️ [{idx+1}/{total_snapshots}] Invalid response: {snapshot_id} - {error_reason}")
+                                continue  # Skip invalid, will retry later
+                            
+                            if data:
+                                # Save to response_table
+                                save_success, error_type = supabase_client.save_response(snapshot_id, data)
+                                
+                                if save_success:
+                                    # Mark as processed (deferred, in bulk)
+                                    pending_marks.append(snapshot_id)
+                                    successful += 1
+                                    stage2_log.append(f"✅ [{idx+1}/{total_snapshots}] Saved: {snapshot_id}")
+                                elif error_type == 'duplicate':
+                                    # Already exists, mark as processed (deferred, in bulk)
+                                    pending_marks.append(snapshot_id)
+                                    skipped += 1
+                                    stage2_log.append(f"ℹ️ [{idx+1}/{total_snapshots}] Duplicate: {snapshot_id}")
+                                else:
+                                    failed += 1
+                                    stage2_log.append(f"❌ [{idx+1}/{total_snapshots}] Failed: {snapshot_id}")
+                            else:
+                                skipped += 1
+                                stage2_log.append(f"⚠️ [{idx+1}/{total_snapshots}] No data: {snapshot_id}")
+                        
+                        except Exception as e:
                             failed += 1
-                            stage2_log.error(f"❌ [{idx+1}/{total_snapshots}] Failed: {snapshot_id}")
-                    else:
-                        skipped += 1
-                        stage2_log.warning(f"⚠️ [{idx+1}/{total_snapshots}] No data: {snapshot_id}")
-                
-                except Exception as e:
-                    failed += 1
-                    stage2_log.error(f"❌ [{idx+1}/{total_snapshots}] Error: {snapshot_id} - {str(e)}")
-                
-                # Small delay
-                import time
-                time.sleep(0.5)
+                            stage2_log.append(f"❌ [{idx+1}/{total_snapshots}] Error: {snapshot_id} - {str(e)}")
+                        
+                        if len(pending_marks) >= MARK_BATCH_SIZE:
+                            flush_marks()
+            finally:
+                # Mark whatever is left, even if the loop was interrupted
+                flush_marks()
+            
+            stage2_log.flush()
             
             stats_stage2 = {
                 'total': total_snapshots,
@@ -660,7 +866,7 @@ def process_automated_pipeline(queries):
         st.info("🚀 **STAGE 3: Extracting emails from responses...**")
         stage3_status = st.empty()
         stage3_progress = st.progress(0)
-        stage3_log = st.empty()
+        stage3_log = LogBuffer(st.empty(), flush_every=1)
         
         # Get unextracted responses
         eligible_count = supabase_client.count_unextracted_responses()
@@ -680,48 +886,65 @@ def process_automated_pipeline(queries):
             total_failed = 0
             total_emails_extracted = 0
             total_duplicate_emails = 0
+            last_snapshot_id = None
+            seen_emails = set()  # Emails already saved this run; repeats skip the upsert
+            ui_throttle = UiThrottle()
             
             for batch_num in range(num_batches):
                 stage3_status.info(f"📦 Processing Batch {batch_num + 1}/{num_batches}")
                 
-                # Fetch current batch
-                rows = supabase_client.get_unextracted_responses(limit=BATCH_SIZE, offset=0)
+                # Fetch next batch by keyset (snapshot_id > last seen)
+                rows = supabase_client.get_unextracted_responses(limit=BATCH_SIZE, after_snapshot_id=last_snapshot_id)
                 
                 if not rows:
                     break
                 
                 batch_total = len(rows)
+                last_snapshot_id = rows[-1].get('snapshot_id')
+                batch_emails = set()
+                batch_snapshot_ids = []
                 
                 for idx, row in enumerate(rows):
                     snapshot_id = row.get('snapshot_id')
                     response_data = row.get('response')
                     
-                    # Update progress
-                    overall_progress = (total_processed + idx + 1) / eligible_count
-                    stage3_progress.progress(min(overall_progress, 1.0))
+                    # Update progress (throttled)
+                    if ui_throttle.ready():
+                        overall_progress = (total_processed + idx + 1) / eligible_count
+                        stage3_progress.progress(min(overall_progress, 1.0))
                     
                     if not snapshot_id or not response_data:
                         total_failed += 1
                         continue
                     
-                    # Extract emails
+                    # Extract emails, dropping ones already saved this run or in this batch
                     emails = extract_emails_from_json(response_data)
-                    
-                    if emails:
-                        for email in emails:
-                            success, error_type = supabase_client.save_email(email)
-                            if success:
-                                total_emails_extracted += 1
-                                stage3_log.success(f"✅ Batch {batch_num + 1} [{idx + 1}/{batch_total}]: {email}")
-                            elif error_type == 'duplicate':
-                                total_duplicate_emails += 1
-                                stage3_log.info(f"ℹ️ Batch {batch_num + 1} [{idx + 1}/{batch_total}]: Duplicate {email}")
-                    
-                    # Mark as extracted
-                    if supabase_client.mark_email_extracted(snapshot_id):
-                        total_successful += 1
+                    new_emails = emails - seen_emails - batch_emails
+                    total_duplicate_emails += len(emails) - len(new_emails)
+                    batch_emails |= new_emails
+                    batch_snapshot_ids.append(snapshot_id)
+                
+                # Save all emails of the batch in a single upsert
+                batch_saved = True
+                if batch_emails:
+                    saved, duplicates, errors = supabase_client.save_emails_bulk(list(batch_emails))
+                    total_emails_extracted += saved
+                    total_duplicate_emails += duplicates
+                    if errors:
+                        batch_saved = False
+                        stage3_log.append(f"❌ Batch {batch_num + 1}: Failed to save {errors} emails; left unextracted for retry")
                     else:
-                        total_failed += 1
+                        seen_emails.update(batch_emails)
+                        stage3_log.append(f"✅ Batch {batch_num + 1}: {saved} saved, {duplicates} duplicates")
+                
+                # Mark the whole batch as extracted, only once its emails are saved
+                if batch_snapshot_ids:
+                    if not batch_saved:
+                        total_failed += len(batch_snapshot_ids)
+                    elif supabase_client.mark_emails_extracted_bulk(batch_snapshot_ids):
+                        total_successful += len(batch_snapshot_ids)
+                    else:
+                        total_failed += len(batch_snapshot_ids)
                 
                 total_processed += batch_total
             
@@ -824,6 +1047,87 @@ def display_results(stats):
                 st.divider()
 
 
+def mark_saved_snapshots(supabase_client, snapshots: list) -> list:
+    """
+    Retry marking snapshots whose response was saved but whose mark failed
+    
+    Args:
+        supabase_client: SupabaseClient instance
+        snapshots: Unprocessed snapshots (dicts with snapshot_id)
+        
+    Returns:
+        The snapshots that still need to be fetched from Brightdata
+    """
+    unmarked_ids = st.session_state.unmarked_ids
+    # Forget IDs that are no longer unprocessed (marked elsewhere since)
+    unmarked_ids.intersection_update(s.get('snapshot_id') for s in snapshots)
+    if not unmarked_ids:
+        return snapshots
+    
+    saved_ids = set(unmarked_ids)
+    if supabase_client.mark_as_processed_bulk(list(saved_ids)):
+        logger.info(f"Marked {len(saved_ids)} previously saved snapshots as processed")
+        unmarked_ids.clear()
+    
+    # Their responses are already stored, so they are never fetched again
+    return [s for s in snapshots if s.get('snapshot_id') not in saved_ids]
+
+
+def write_responses(supabase_client, write_queue: Queue, batch_size: int = 20) -> dict:
+    """
+    Drain (snapshot_id, data) items from a queue into Supabase in batches
+    
+    Runs on a writer thread so saving overlaps with fetching. Each batch is
+    saved with one upsert and marked processed with one update. A None item
+    ends the loop.
+    
+    Args:
+        supabase_client: SupabaseClient instance
+        write_queue: Queue of (snapshot_id, data) tuples, terminated by None
+        batch_size: Maximum responses per upsert (default 20)
+        
+    Returns:
+        Dictionary with saved/duplicates/failed counts, IDs saved but not
+        marked processed, and error messages
+    """
+    stats = {'saved': 0, 'duplicates': 0, 'failed': 0, 'unmarked_ids': [], 'errors': []}
+    done = False
+    
+    while not done:
+        item = write_queue.get()
+        if item is None:
+            break
+        
+        # Take whatever else is already queued, up to batch_size
+        batch = [item]
+        while len(batch) < batch_size:
+            try:
+                item = write_queue.get_nowait()
+            except Empty:
+                break
+            if item is None:
+                done = True
+                break
+            batch.append(item)
+        
+        snapshot_ids = [snapshot_id for snapshot_id, _ in batch]
+        saved, duplicates, failed = supabase_client.save_responses_bulk(batch)
+        
+        if failed:
+            stats['failed'] += failed
+            stats['errors'].append(f"Database error: Failed to save {failed} responses ({snapshot_ids[0]}…)")
+        elif supabase_client.mark_as_processed_bulk(snapshot_ids):
+            # Duplicates already have a response row, so they are marked too
+            stats['saved'] += saved
+            stats['duplicates'] += duplicates
+        else:
+            stats['failed'] += len(batch)
+            stats['unmarked_ids'].extend(snapshot_ids)
+            stats['errors'].append(f"Database error: Failed to mark {len(batch)} snapshots as processed ({snapshot_ids[0]}…)")
+    
+    return stats
+
+
 def process_unprocessed_snapshots():
     """
     Process all unprocessed snapshots from Supabase
@@ -848,16 +1152,12 @@ def process_unprocessed_snapshots():
                 'message': 'API key not provided'
             }
         
-        # Initialize clients
-        brightdata_url = os.getenv('BRIGHTDATA_URL') or ""
-        supabase_url = os.getenv('SUPABASE_URL') or ""
-        supabase_key = os.getenv('SUPABASE_KEY') or ""
-        
-        brightdata_client = BrightdataClient(api_key, brightdata_url)
-        supabase_client = SupabaseClient(supabase_url, supabase_key)
+        # Reuse clients cached in session state
+        brightdata_client, supabase_client = get_clients(api_key)
         
-        # Get unprocessed snapshots (now returns list of dicts with snapshot_id and query)
-        snapshots = supabase_client.get_unprocessed_snapshots()
+        # Get unprocessed snapshots (now returns list of dicts with snapshot_id and query),
+        # marking ones whose response was already saved instead of fetching them again
+        snapshots = mark_saved_snapshots(supabase_client, supabase_client.get_unprocessed_snapshots())
         
         if not snapshots:
             return {
@@ -883,86 +1183,87 @@ def process_unprocessed_snapshots():
         progress_bar = st.progress(0)
         status_text = st.empty()
         query_text = st.empty()
-        error_text = st.empty()
-        
-        for idx, snapshot_data in enumerate(snapshots):
-            snapshot_id = snapshot_data.get('snapshot_id')
-            queries = snapshot_data.get('query', [])
-            
-            # Update progress
-            progress = (idx + 1) / total
-            progress_bar.progress(progress)
-            status_text.text(f"Processing {idx + 1}/{total}: {snapshot_id}")
-            
-            # Display queries associated with this snapshot
-            if queries:
-                query_text.info(f"📝 Queries: {' | '.join(queries)}")
+        error_text = LogBuffer(st.empty())
+        
+        # Fetch all snapshots concurrently (bounded by FETCH_WORKERS); valid
+        # responses go through a queue to a single writer thread that saves them
+        # in batches, so Supabase writes overlap with fetching. UI updates stay
+        # on the main thread.
+        write_queue = Queue(maxsize=100)
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor, ThreadPoolExecutor(max_workers=1) as writer:
+            writer_future = writer.submit(write_responses, supabase_client, write_queue)
+            futures = {
+                executor.submit(brightdata_client.get_snapshot_data, s.get('snapshot_id')): s
+                for s in snapshots
+            }
             
+            ui_throttle = UiThrottle()
             try:
-                # Retrieve snapshot data with validation
-                result = brightdata_client.get_snapshot_data(snapshot_id)
-                
-                # Handle tuple unpacking - new version returns 4 values
-                if len(result) == 4:
-                    data, is_running, is_valid, error_reason = result
-                else:
-                    # Fallback for old version (shouldn't happen after restart)
-                    data, is_running = result
-                    is_valid = not is_running and data is not None
-                    error_reason = "Legacy response format"
-                
-                # Check if response is invalid (status running or error with size < 2000)
-                if not is_valid:
-                    # Don't save to response_table, keep processed = false
-                    invalid_responses += 1
-                    if is_running:
-                        running_snapshots += 1
-                    logger.warning(f"Snapshot {snapshot_id} is invalid: {error_reason} - skipping (will remain unprocessed)")
-                    error_text.warning(f"⚠️ Invalid response for {snapshot_id}: {error_reason}")
-                    continue  # Skip to next snapshot
+                for idx, future in enumerate(as_completed(futures)):
+                    snapshot_data = futures[future]
+                    snapshot_id = snapshot_data.get('snapshot_id')
+                    queries = snapshot_data.get('query', [])
                     
-            except Exception as e:
-                # Handle any errors during retrieval
-                failed += 1
-                error_msg = f"Error retrieving {snapshot_id}: {str(e)}"
-                logger.error(error_msg)
-                error_text.error(f"❌ {error_msg}")
-                continue  # Skip to next snapshot
-            
-            # Process valid data
-            if data:
-                # Save response to Supabase response_table
-                save_success, error_type = supabase_client.save_response(snapshot_id, data)
-                if save_success:
-                    # Mark as processed in snapshot_table
-                    if supabase_client.mark_as_processed(snapshot_id):
-                        successful += 1
-                        logger.info(f"Successfully processed snapshot {snapshot_id}")
-                    else:
+                    # Update progress and show this snapshot's queries (throttled)
+                    if ui_throttle.ready():
+                        progress_bar.progress((idx + 1) / total)
+                        status_text.text(f"Processing {idx + 1}/{total}: {snapshot_id}")
+                        if queries:
+                            query_text.info(f"📝 Queries: {' | '.join(queries)}")
+                    
+                    try:
+                        # Collect fetched snapshot data with validation
+                        result = future.result()
+                        
+                        # Handle tuple unpacking - new version returns 4 values
+                        if len(result) == 4:
+                            data, is_running, is_valid, error_reason = result
+                        else:
+                            # Fallback for old version (shouldn't happen after restart)
+                            data, is_running = result
+                            is_valid = not is_running and data is not None
+                            error_reason = "Legacy response format"
+                        
+                        # Check if response is invalid (status running or error with size < 2000)
+                        if not is_valid:
+                            # Don't save to response_table, keep processed = false
+                            invalid_responses += 1
+                            if is_running:
+                                running_snapshots += 1
+                            logger.warning(f"Snapshot {snapshot_id} is invalid: {error_reason} - skipping (will remain unprocessed)")
+                            error_text.append(f"⚠️ Invalid response for {snapshot_id}: {error_reason}")
+                            continue  # Skip to next snapshot
+                    
+                    except Exception as e:
+                        # Handle any errors during retrieval
                         failed += 1
-                        db_errors += 1
-                        error_msg = f"Database error: Failed to mark {snapshot_id} as processed"
+                        error_msg = f"Error retrieving {snapshot_id}: {str(e)}"
                         logger.error(error_msg)
-                        error_text.error(error_msg)
-                elif error_type == 'duplicate':
-                    duplicate_snapshots += 1
-                    # Still mark as processed since response already exists
-                    supabase_client.mark_as_processed(snapshot_id)
-                else:
-                    failed += 1
-                    db_errors += 1
-                    error_msg = f"Database error: Failed to save response for {snapshot_id}"
-                    logger.error(error_msg)
-                    error_text.error(error_msg)
-            else:
-                # Skip this snapshot
-                skipped += 1
-                logger.warning(f"Skipped snapshot {snapshot_id} - no data received")
-            
-            # Add small delay
-            import time
-            time.sleep(0.5)
-        
+                        error_text.append(f"❌ {error_msg}")
+                        continue  # Skip to next snapshot
+                    
+                    # Queue valid data for the writer thread
+                    if data:
+                        write_queue.put((snapshot_id, data))
+                    else:
+                        # Skip this snapshot
+                        skipped += 1
+                        logger.warning(f"Skipped snapshot {snapshot_id} - no data received")
+            finally:
+                write_queue.put(None)
+            
+            write_stats = writer_future.result()
+        
+        successful = write_stats['saved']
+        st.session_state.unmarked_ids.update(write_stats['unmarked_ids'])
+        duplicate_snapshots = write_stats['duplicates']
+        failed += write_stats['failed']
+        db_errors += write_stats['failed']
+        for error_msg in write_stats['errors']:
+            logger.error(error_msg)
+            error_text.append(f"❌ {error_msg}")
+        
+        error_text.flush()
         progress_bar.progress(1.0)
         status_text.text("Processing complete!")
         
@@ -994,17 +1295,34 @@ def process_unprocessed_snapshots():
         }
 
 
+@st.cache_data(ttl=30, show_spinner=False)
+def cached_unprocessed_snapshots() -> list:
+    """
+    Get unprocessed snapshots, cached for 30 seconds across reruns
+    
+    Returns:
+        List of dicts with snapshot_id and query
+    """
+    return get_supabase_client().get_unprocessed_snapshots()
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def cached_unextracted_count() -> int:
+    """
+    Count unextracted responses, cached for 30 seconds across reruns
+    
+    Returns:
+        Number of rows in response_table with is_email_extracted = false
+    """
+    return get_supabase_client().count_unextracted_responses()
+
+
 def display_stage2_tab():
     """Display Stage 2 tab for retrieving snapshot data"""
     st.header("📥 Stage 2: Retrieve Snapshot Data")
     
-    # Initialize clients to get count
-    supabase_url = os.getenv('SUPABASE_URL') or ""
-    supabase_key = os.getenv('SUPABASE_KEY') or ""
-    supabase_client = SupabaseClient(supabase_url, supabase_key)
-    
-    # Get unprocessed snapshots (returns list of dicts with snapshot_id and query)
-    snapshots = supabase_client.get_unprocessed_snapshots()
+    # Get unprocessed snapshots (list of dicts with snapshot_id and query, cached briefly)
+    snapshots = cached_unprocessed_snapshots()
     eligible_count = len(snapshots)
     
     col1, col2 = st.columns([1, 1])
@@ -1044,6 +1362,8 @@ def display_stage2_tab():
         else:
             with st.spinner("Processing..."):
                 result = process_unprocessed_snapshots()
+            cached_unprocessed_snapshots.clear()
+            cached_unextracted_count.clear()
             
             st.divider()
             
@@ -1081,45 +1401,6 @@ def display_stage2_tab():
                 st.error("Processing failed")
 
 
-def extract_emails_from_text(text: str) -> list:
-    """
-    Extract email addresses from text using regex
-    
-    Args:
-        text: Text content to extract emails from
-        
-    Returns:
-        List of unique email addresses
-    """
-    # Email regex pattern
-    email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-    
-    # Find all emails
-    emails = re.findall(email_pattern, text)
-    
-    # Return unique emails
-    return list(set(emails))
-
-
-def extract_emails_from_json(json_data):
-    """
-    Extract email addresses from JSON data using regex
-    
-    Args:
-        json_data: JSON data (dict, list, or any JSON structure)
-        
-    Returns:
-        List of unique email addresses
-    """
-    import json
-    
-    # Convert JSON to string to search through it
-    json_string = json.dumps(json_data)
-    
-    # Extract emails from the JSON string
-    return extract_emails_from_text(json_string)
-
-
 def process_all_responses_for_emails(total_count: int):
     """
     Process all unextracted responses sequentially in batches
@@ -1131,12 +1412,10 @@ def process_all_responses_for_emails(total_count: int):
         Dictionary with extraction statistics
     """
     try:
-        # Initialize Supabase client
-        supabase_url = os.getenv('SUPABASE_URL') or ""
-        supabase_key = os.getenv('SUPABASE_KEY') or ""
-        supabase_client = SupabaseClient(supabase_url, supabase_key)
+        # Reuse the process-wide Supabase client
+        supabase_client = get_supabase_client()
         
-        BATCH_SIZE = 20
+        BATCH_SIZE = 100
         num_batches = (total_count + BATCH_SIZE - 1) // BATCH_SIZE
         
         # Initialize overall counters
@@ -1151,26 +1430,31 @@ def process_all_responses_for_emails(total_count: int):
         overall_progress_bar = st.progress(0)
         batch_status = st.empty()
         current_batch_progress = st.empty()
-        email_log = st.empty()
+        email_log = LogBuffer(st.empty(), flush_every=1)
+        last_snapshot_id = None
+        seen_emails = set()  # Emails already saved this run; repeats skip the upsert
         
         # Process in batches
         for batch_num in range(num_batches):
             batch_status.info(f"📦 Processing Batch {batch_num + 1}/{num_batches}")
             
-            # Fetch current batch (always from offset 0 since we mark as extracted)
-            rows = supabase_client.get_unextracted_responses(limit=BATCH_SIZE, offset=0)
+            # Fetch next batch by keyset (snapshot_id > last seen)
+            rows = supabase_client.get_unextracted_responses(limit=BATCH_SIZE, after_snapshot_id=last_snapshot_id)
             
             if not rows:
                 batch_status.warning(f"Batch {batch_num + 1}: No more rows to process")
                 break
             
-            # Process each row in current batch
-            batch_total = len(rows)
+            last_snapshot_id = rows[-1].get('snapshot_id')
+            
+            # Collect emails and snapshot IDs of the current batch
             batch_emails = 0
             batch_duplicates = 0
             batch_errors = 0
+            batch_all_emails = set()
+            batch_snapshot_ids = []
             
-            for idx, row in enumerate(rows):
+            for row in rows:
                 snapshot_id = row.get('snapshot_id')
                 response_data = row.get('response')
                 
@@ -1179,32 +1463,38 @@ def process_all_responses_for_emails(total_count: int):
                     batch_errors += 1
                     continue
                 
-                # Extract emails from response
+                # Extract emails from response, dropping ones already saved this run or in this batch
                 emails = extract_emails_from_json(response_data)
-                
-                if emails:
-                    # Save each email
-                    for email in emails:
-                        success, error_type = supabase_client.save_email(email)
-                        if success:
-                            batch_emails += 1
-                            email_log.success(f"✅ Batch {batch_num + 1} [{idx + 1}/{batch_total}]: Saved {email}")
-                        elif error_type == 'duplicate':
-                            batch_duplicates += 1
-                            email_log.info(f"ℹ️ Batch {batch_num + 1} [{idx + 1}/{batch_total}]: Duplicate {email}")
-                        else:
-                            batch_errors += 1
-                            email_log.error(f"❌ Batch {batch_num + 1} [{idx + 1}/{batch_total}]: Failed {email}")
-                
-                # Mark as extracted
-                if supabase_client.mark_email_extracted(snapshot_id):
-                    total_successful += 1
-                else:
-                    total_failed += 1
-                    batch_errors += 1
-                
+                new_emails = emails - seen_emails - batch_all_emails
+                batch_duplicates += len(emails) - len(new_emails)
+                batch_all_emails |= new_emails
+                batch_snapshot_ids.append(snapshot_id)
                 total_processed += 1
             
+            # Save all emails of the batch in a single upsert
+            batch_saved = True
+            if batch_all_emails:
+                saved, duplicates, errors = supabase_client.save_emails_bulk(list(batch_all_emails))
+                batch_emails += saved
+                batch_duplicates += duplicates
+                batch_errors += errors
+                if errors:
+                    batch_saved = False
+                    email_log.append(f"❌ Batch {batch_num + 1}: Failed to save {errors} emails; left unextracted for retry")
+                else:
+                    seen_emails.update(batch_all_emails)
+                    email_log.append(f"✅ Batch {batch_num + 1}: {saved} saved, {duplicates} duplicates")
+            
+            # Mark the whole batch as extracted, only once its emails are saved
+            if batch_snapshot_ids:
+                if not batch_saved:
+                    total_failed += len(batch_snapshot_ids)
+                elif supabase_client.mark_emails_extracted_bulk(batch_snapshot_ids):
+                    total_successful += len(batch_snapshot_ids)
+                else:
+                    total_failed += len(batch_snapshot_ids)
+                    batch_errors += len(batch_snapshot_ids)
+            
             # Update overall progress
             overall_progress = min(total_processed / total_count, 1.0)
             overall_progress_bar.progress(overall_progress)
@@ -1255,22 +1545,23 @@ def process_responses_for_emails(batch_size: int = 20):
         Dictionary with extraction statistics
     """
     try:
-        # Initialize Supabase client
-        supabase_url = os.getenv('SUPABASE_URL') or ""
-        supabase_key = os.getenv('SUPABASE_KEY') or ""
-        supabase_client = SupabaseClient(supabase_url, supabase_key)
+        # Reuse the process-wide Supabase client
+        supabase_client = get_supabase_client()
         
         # Fetch in sub-batches of 20 to avoid timeout
         SUB_BATCH_SIZE = 20
         all_rows = []
+        last_snapshot_id = None
         
-        for offset in range(0, batch_size, SUB_BATCH_SIZE):
-            current_limit = min(SUB_BATCH_SIZE, batch_size - offset)
-            rows_batch = supabase_client.get_unextracted_responses(limit=current_limit, offset=offset)
+        while len(all_rows) < batch_size:
+            current_limit = min(SUB_BATCH_SIZE, batch_size - len(all_rows))
+            # Keyset pagination: each page starts after the last snapshot_id seen
+            rows_batch = supabase_client.get_unextracted_responses(limit=current_limit, after_snapshot_id=last_snapshot_id)
             all_rows.extend(rows_batch)
             if len(rows_batch) < current_limit:
                 # No more rows available
                 break
+            last_snapshot_id = rows_batch[-1]['snapshot_id']
         
         rows = all_rows
         
@@ -1294,13 +1585,14 @@ def process_responses_for_emails(batch_size: int = 20):
         # Process each response with progress
         progress_bar = st.progress(0)
         status_text = st.empty()
-        email_log = st.empty()
+        email_log = LogBuffer(st.empty())
         
+        ui_throttle = UiThrottle()
         for idx, row in enumerate(rows):
-            # Update progress
-            progress = (idx + 1) / total
-            progress_bar.progress(progress)
-            status_text.text(f"Processing {idx + 1}/{total}: Snapshot {row['snapshot_id']}")
+            # Update progress (throttled)
+            if ui_throttle.ready():
+                progress_bar.progress((idx + 1) / total)
+                status_text.text(f"Processing {idx + 1}/{total}: Snapshot {row['snapshot_id']}")
             
             # Extract emails from response JSON
             response_data = row.get('response', {})
@@ -1313,15 +1605,13 @@ def process_responses_for_emails(batch_size: int = 20):
                     success, error_type = supabase_client.save_email(email)
                     if success:
                         total_emails_extracted += 1
-                        email_log.success(f"✅ Saved: {email}")
                     elif error_type == 'duplicate':
                         duplicate_emails += 1
-                        email_log.info(f"ℹ️ Duplicate: {email} (already exists)")
                     else:
                         email_save_failed = True
                         db_errors += 1
-                        email_log.error(f"❌ Failed: {email} (database error)")
                         logger.error(f"Database error: Failed to save email {email}")
+                    email_log.append(LOG_PREFIX[error_type] + email)
                 logger.info(f"Extracted {len(emails)} emails from snapshot {row['snapshot_id']}")
             
             # Mark as extracted regardless of whether emails were found
@@ -1332,8 +1622,9 @@ def process_responses_for_emails(batch_size: int = 20):
                 db_errors += 1
                 error_msg = f"Database error: Failed to mark {row['snapshot_id']} as extracted"
                 logger.error(error_msg)
-                email_log.error(f"❌ {error_msg}")
+                email_log.append(f"❌ {error_msg}")
         
+        email_log.flush()
         progress_bar.progress(1.0)
         status_text.text("Processing complete!")
         
@@ -1365,16 +1656,11 @@ def display_stage3_tab():
     """Display Stage 3 tab for extracting emails from response_table"""
     st.header("📧 Stage 3: Extract Emails")
     
-    # Initialize clients to get count
-    supabase_url = os.getenv('SUPABASE_URL') or ""
-    supabase_key = os.getenv('SUPABASE_KEY') or ""
-    supabase_client = SupabaseClient(supabase_url, supabase_key)
-    
-    # Get unextracted count
-    eligible_count = supabase_client.count_unextracted_responses()
+    # Get unextracted count (cached briefly)
+    eligible_count = cached_unextracted_count()
     
-    # Calculate number of batches
-    BATCH_SIZE = 20
+    # Calculate number of batches (matches process_all_responses_for_emails)
+    BATCH_SIZE = 100
     num_batches = (eligible_count + BATCH_SIZE - 1) // BATCH_SIZE if eligible_count > 0 else 0
     
     col1, col2 = st.columns([1, 1])
@@ -1383,7 +1669,7 @@ def display_stage3_tab():
         st.metric("Total Eligible Rows", eligible_count)
     
     with col2:
-        st.metric("Batches (20 rows each)", num_batches)
+        st.metric(f"Batches ({BATCH_SIZE} rows each)", num_batches)
     
     st.divider()
     
@@ -1401,6 +1687,7 @@ def display_stage3_tab():
             st.info("No unextracted responses found")
         else:
             result = process_all_responses_for_emails(eligible_count)
+            cached_unextracted_count.clear()
             
             st.divider()
             
@@ -1457,10 +1744,8 @@ def display_stage4_tab():
     )
     
     if fetch_button:
-        # Initialize Supabase client
-        supabase_url = os.getenv('SUPABASE_URL') or ""
-        supabase_key = os.getenv('SUPABASE_KEY') or ""
-        supabase_client = SupabaseClient(supabase_url, supabase_key)
+        # Reuse the process-wide Supabase client
+        supabase_client = get_supabase_client()
         
         # Convert dates to string format if provided
         start_date_str = None
@@ -1480,51 +1765,51 @@ def display_stage4_tab():
             else:
                 end_date_str = end_date.strftime('%Y-%m-%d')
         
-        with st.spinner("Fetching emails..."):
-            emails = supabase_client.get_emails_by_date(start_date_str, end_date_str)
+        # Stream rows into the display rows and CSV as they arrive
+        display_rows = []
+        csv_output = StringIO()
+        csv_writer = csv.writer(csv_output)
+        csv_writer.writerow(['email', 'created_at'])
+        
+        with st.status("Fetching emails...") as fetch_status:
+            try:
+                for row in supabase_client.iter_emails_by_date(start_date_str, end_date_str, page_size=STAGE4_PAGE_SIZE):
+                    # Supabase returns UTC ISO8601 timestamps; trim to "YYYY-MM-DD HH:MM:SS"
+                    email, created_at = row.get('email'), (row.get('created_at') or '')[:19].replace('T', ' ')
+                    # Plain csv.writer on tuples skips DictWriter's per-row key validation
+                    csv_writer.writerow((email, created_at))
+                    display_rows.append({'email': email, 'created_at': created_at})
+                    if len(display_rows) % STAGE4_PAGE_SIZE == 0:
+                        fetch_status.update(label=f"Fetching emails... {len(display_rows)} so far")
+            except Exception as e:
+                # Don't offer a partial result as a complete export
+                fetch_status.update(label=f"Fetching emails failed after {len(display_rows)} rows", state="error")
+                st.error(f"❌ Error fetching emails: {str(e)}")
+                return
+            fetch_status.update(label=f"Fetched {len(display_rows)} emails", state="complete")
         
         st.divider()
         
-        if emails:
-            st.metric("Total Emails", len(emails))
+        if display_rows:
+            st.metric("Total Emails", len(display_rows))
             
             st.divider()
             
             # Display emails in a table
             st.subheader("📮 Email List")
+            st.dataframe(display_rows, use_container_width=True, height=400)
             
-            # Create DataFrame for better display
-            import pandas as pd
-            df = pd.DataFrame(emails)
-            
-            # Display only email column if exists, otherwise show all
-            if 'email' in df.columns:
-                if 'created_at' in df.columns:
-                    df_display = df[['email', 'created_at']].copy()
-                    # Robust parsing for ISO8601 with microseconds and timezone; coerce invalids
-                    parsed = pd.to_datetime(df_display['created_at'], errors='coerce', utc=True)
-                    # Convert to naive local time (UTC -> naive) for display
-                    df_display['created_at'] = parsed.dt.tz_convert(None).dt.strftime('%Y-%m-%d %H:%M:%S')
-                else:
-                    df_display = df[['email']]
-                
-                st.dataframe(df_display, use_container_width=True, height=400)
-                
-                # Download button
-                st.divider()
-                csv = df_display.to_csv(index=False)
-                st.download_button(
-                    label="💾 Download as CSV",
-                    data=csv,
-                    file_name=f"emails_{start_date_str or 'all'}_{end_date_str or 'all'}.csv",
-                    mime="text/csv"
-                )
-            else:
-                st.dataframe(df, use_container_width=True)
+            # Download button (CSV written directly, no DataFrame)
+            st.divider()
+            st.download_button(
+                label="💾 Download as CSV",
+                data=csv_output.getvalue(),
+                file_name=f"emails_{start_date_str or 'all'}_{end_date_str or 'all'}.csv",
+                mime="text/csv"
+            )
         else:
             st.info("No emails found for the selected date range")
 
-
 def main():
     """Main Streamlit application"""
     initialize_session_state()
@@ -1562,16 +1847,16 @@ def main():
     
         # Process uploaded file
         if uploaded_file is not None:
-            queries = load_csv_queries(uploaded_file)
+            # Count and preview in one cached pass; the full list is only built on Process
+            total_queries, preview_queries = summarize_csv_queries(uploaded_file.getvalue())
             
-            if queries:
+            if total_queries:
                 st.session_state.queries_loaded = True
-                st.session_state.queries = queries
                 
                 st.divider()
                 
                 # Display queries preview
-                display_queries_preview(queries)
+                display_queries_preview(total_queries, preview_queries)
                 
                 st.divider()
                 
@@ -1596,6 +1881,9 @@ def main():
                 )
                 
                 if start_button:
+                    queries = load_csv_queries(uploaded_file)
+                    st.session_state.queries = queries
+                    
                     if queries:
                         st.session_state.processing_started = True
                         
@@ -1608,6 +1896,10 @@ def main():
                             
                             with st.spinner("Running automated pipeline..."):
                                 results = process_automated_pipeline(queries)
+                            # Submitted queries now exist, so Stage 0 must not list them as new
+                            cached_existing_queries.clear()
+                            cached_unprocessed_snapshots.clear()
+                            cached_unextracted_count.clear()
                             
                             if results:
                                 st.session_state.processing_complete = True
@@ -1618,6 +1910,8 @@ def main():
                             # ============================================
                             with st.spinner("Processing queries..."):
                                 results = process_queries(queries)
+                            cached_existing_queries.clear()
+                            cached_unprocessed_snapshots.clear()
                             
                             if results:
                                 st.session_state.processing_complete = True
@@ -1665,10 +1959,4 @@ Success Rate: {(results['successful_snapshots']/results['total_batches']*100):.1
 
 
 if __name__ == "__main__":
-    try:
-        import pandas as pd
-    except ImportError:
-        st.error("Please install pandas: pip install pandas")
-        st.stop()
-    
     main()
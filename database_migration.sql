@@ -13,6 +13,102 @@ ON snapshot_table USING GIN (query);
 -- Step 3: Add comment for documentation
 COMMENT ON COLUMN snapshot_table.query IS 'Array of search queries processed in this snapshot (batch of 2)';
 
+-- Step 4: Server-side lookup of already processed queries (used by Stage 0)
+-- Returns the distinct lowercase form of stored queries matching one of the
+-- (lowercase) candidates, so the app only downloads the intersection instead
+-- of the whole table, and each match once regardless of its stored casing.
+-- Matching lower(q) cannot use idx_snapshot_query, so each call scans and
+-- unnests snapshot_table once; the app sends all candidates in one call.
+CREATE OR REPLACE FUNCTION find_existing_queries(candidates TEXT[])
+RETURNS TABLE (query TEXT)
+LANGUAGE sql STABLE
+AS $$
+    SELECT DISTINCT lower(q)
+    FROM snapshot_table, unnest(snapshot_table.query) AS q
+    WHERE lower(q) = ANY(candidates)
+$$;
+
+-- Step 5: Keep email_table case-insensitive unique
+-- The app lowercases emails before saving. Normalize rows saved before that
+-- change, then enforce it (the UPDATE fails if two rows differ only by case;
+-- delete one of each such pair first).
+-- UPDATE email_table SET email = lower(email) WHERE email <> lower(email);
+-- CREATE UNIQUE INDEX IF NOT EXISTS idx_email_table_email_lower ON email_table (lower(email));
+
+-- Step 6: Partial index over responses still waiting for email extraction
+-- Keeps count_unextracted_responses and the keyset pages of
+-- get_unextracted_responses proportional to the backlog, not the table
+CREATE INDEX IF NOT EXISTS idx_response_unextracted
+ON response_table (snapshot_id) WHERE is_email_extracted = false;
+
+-- Step 7: Store snapshot responses and mark their snapshots processed together
+-- Used by Stage2 (SupabaseClient.ingest_snapshots): one round trip and one
+-- transaction per batch, so a saved response never leaves its snapshot
+-- unprocessed. Takes [{"snapshot_id": ..., "response": {...}}, ...] and
+-- returns the number of newly inserted responses.
+CREATE OR REPLACE FUNCTION ingest_snapshots(items JSONB)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    inserted INTEGER;
+BEGIN
+    INSERT INTO response_table (snapshot_id, response, is_email_extracted)
+    SELECT item->>'snapshot_id', item->'response', false
+    FROM jsonb_array_elements(items) AS item
+    ON CONFLICT (snapshot_id) DO NOTHING;
+    GET DIAGNOSTICS inserted = ROW_COUNT;
+
+    UPDATE snapshot_table
+    SET processed = true
+    WHERE snapshot_id IN (SELECT item->>'snapshot_id' FROM jsonb_array_elements(items) AS item);
+
+    RETURN inserted;
+END;
+$$;
+
+-- Step 8: Extract emails inside Postgres (optional Stage 3 path)
+-- Used by stage3_server.py when STAGE3_SQL_EXTRACTION=1: claims a batch of
+-- unextracted responses, regex-scans their JSON text, inserts the lowercased
+-- emails and marks the rows extracted, all in one call. \y is the Postgres
+-- word boundary (\b means backspace there).
+CREATE OR REPLACE FUNCTION extract_emails_batch(batch_size INTEGER DEFAULT 100)
+RETURNS TABLE (rows_processed INTEGER, emails_saved INTEGER)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    ids TEXT[];
+BEGIN
+    SELECT array_agg(batch.snapshot_id) INTO ids
+    FROM (
+        SELECT r.snapshot_id
+        FROM response_table r
+        WHERE r.is_email_extracted = false
+        ORDER BY r.snapshot_id
+        LIMIT batch_size
+        FOR UPDATE SKIP LOCKED
+    ) AS batch;
+
+    rows_processed := coalesce(cardinality(ids), 0);
+    emails_saved := 0;
+    IF rows_processed = 0 THEN
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    INSERT INTO email_table (email)
+    SELECT DISTINCT lower(m[1])
+    FROM response_table r,
+         regexp_matches(r.response::text, '\y([A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,})\y', 'g') AS m
+    WHERE r.snapshot_id = ANY(ids)
+    ON CONFLICT (email) DO NOTHING;
+    GET DIAGNOSTICS emails_saved = ROW_COUNT;
+
+    UPDATE response_table SET is_email_extracted = true WHERE snapshot_id = ANY(ids);
+    RETURN NEXT;
+END;
+$$;
+
 -- Verification Query: Check the updated schema
 -- SELECT column_name, data_type, is_nullable, column_default
 -- FROM information_schema.columns
@@ -4,16 +4,26 @@ This script processes search queries, sends them to Brightdata API in batches,
 and stores the snapshot IDs in Supabase.
 """
 
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+import math
+import orjson
 import time
 import os
+import re
 import csv
-from typing import List, Dict, Optional
-from supabase import create_client, Client
+import threading
+from typing import Callable, Iterator, List, Dict, Optional, Set
+from supabase import create_client, Client, ClientOptions
+from postgrest.exceptions import APIError
 from postgrest.types import CountMethod
 from dotenv import load_dotenv
 import logging
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Load environment variables from project-local .env reliably
 
@@ -34,43 +44,218 @@ BRIGHTDATA_API_KEY = os.getenv('BRIGHTDATA_API_KEY', "")
 SUPABASE_URL = os.getenv('SUPABASE_URL', "")
 SUPABASE_KEY = os.getenv('SUPABASE_KEY', "")
 
+# Running marker in a raw snapshot body; a C-level scan of the bytes replaces
+# walking every item of large list payloads in Python
+_STATUS_RUNNING_RE = re.compile(rb'"status"\s*:\s*"running"')
+
+# One Brightdata input item; only the JSON-encoded keyword varies per item
+_PAYLOAD_ITEM_TEMPLATE = b'{"url":"https://www.google.com/","keyword":%b,"language":"","uule":"","brd_mobile":""}'
+
+
+def _is_unique_violation(error: Exception) -> bool:
+    """True if error is a Postgres unique_violation (SQLSTATE 23505)"""
+    if isinstance(error, APIError):
+        return error.code == '23505'
+    # Unknown exception types: fall back to the error text
+    error_str = str(error).lower()
+    return 'duplicate' in error_str or 'unique' in error_str
+
+
+# Email regex pattern, compiled once at import. Uses google-re2 (linear-time
+# DFA, no backtracking) when installed, otherwise the stdlib engine with
+# ASCII-only classes; JSON text is ASCII-escaped anyway
+EMAIL_PATTERN = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b'
+try:
+    import re2
+    EMAIL_REGEX = re2.compile(EMAIL_PATTERN)
+except ImportError:
+    EMAIL_REGEX = re.compile(EMAIL_PATTERN, re.ASCII)
+
+
+def extract_emails_from_text(text: str) -> Set[str]:
+    """
+    Extract email addresses from text using regex
+    
+    Args:
+        text: Text content to extract emails from
+        
+    Returns:
+        Set of unique lowercase email addresses
+    """
+    # Find all emails, lowercased so case variants collapse to one row
+    return {email.lower() for email in EMAIL_REGEX.findall(text)}
+
+
+def extract_emails_from_json(json_data) -> Set[str]:
+    """
+    Extract email addresses from JSON data using regex
+    
+    Args:
+        json_data: JSON data (dict, list, or any JSON structure)
+        
+    Returns:
+        Set of unique lowercase email addresses
+    """
+    # Fast reject: orjson serializes in native code and the bytes '@' test is
+    # a memchr, far cheaper than walking a response that holds no address
+    try:
+        if b'@' not in orjson.dumps(json_data):
+            return set()
+    except TypeError:
+        pass  # Not JSON-serializable; fall through to the walk
+    
+    # Walk the parsed structure and scan only string values (and keys),
+    # instead of serializing the whole document with json.dumps
+    emails = set()
+    stack = [json_data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, str):
+            if '@' in node:
+                emails.update(email.lower() for email in EMAIL_REGEX.findall(node))
+        elif isinstance(node, dict):
+            stack.extend(node.keys())
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+    
+    return emails
+
+
+class TokenBucket:
+    """Thread-safe token bucket: rate tokens per second, bursts up to capacity"""
+    
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def take(self):
+        """Take one token, sleeping only if none is available yet"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Reserve the token now; a negative balance is the wait before it exists
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
 
 class BrightdataClient:
     """Client for interacting with Brightdata API"""
     
-    def __init__(self, api_key: str, url: str):
+    # Query parameters shared by every snapshot download
+    SNAPSHOT_PARAMS = {'format': 'json'}
+    # Longest Retry-After honored; longer waits would park a worker thread
+    MAX_RETRY_AFTER = 60
+    
+    def __init__(self, api_key: str, url: str, running_ttl: float = 0,
+                 rate_limiter: Optional[TokenBucket] = None):
         self.api_key = api_key
         self.url = url
+        # Optional limiter shared by every snapshot download of this client
+        self.rate_limiter = rate_limiter
+        # Snapshot endpoint derived once from the trigger URL
+        base_url = url.split('/trigger')[0] if '/trigger' in url else 'https://api.brightdata.com/datasets/v3'
+        self.snapshot_base = f"{base_url}/snapshot/"
         self.headers = {
             'Authorization': f'Bearer {api_key}',
             'Content-Type': 'application/json'
         }
+        
+        # One pooled session so TCP/TLS connections are reused across calls
+        # (and across worker threads). Only idempotent GETs are retried on
+        # gateway errors; 429/503 are handled in get_snapshot_data.
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(
+            pool_connections=20,
+            pool_maxsize=50,
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 504],
+                              allowed_methods=frozenset({'GET'}), raise_on_status=False)
+        )
+        self.session.mount('https://', adapter)
+        
+        # Poll short-circuits for snapshots still running: ETags for
+        # If-None-Match, and for running_ttl seconds (0 = disabled) a snapshot
+        # seen running is reported running again without a request
+        self.running_ttl = running_ttl
+        self._etags: Dict[str, str] = {}
+        self._running_until: Dict[str, float] = {}
+    
+    def _remember_running(self, snapshot_id: str, etag: Optional[str] = None):
+        """Remember that a snapshot was running at its last poll"""
+        if etag:
+            self._etags[snapshot_id] = etag
+        if self.running_ttl > 0:
+            self._running_until[snapshot_id] = time.monotonic() + self.running_ttl
     
-    def get_snapshot_data(self, snapshot_id: str) -> tuple[Optional[Dict], bool, bool, str]:
+    def close(self):
+        """Close pooled HTTP connections"""
+        self.session.close()
+    
+    def get_snapshot_data(self, snapshot_id: str, max_retries: int = 3) -> tuple[Optional[Dict], bool, bool, str]:
         """
         Retrieve data for a specific snapshot ID
         
+        Requests are sent without delay; only HTTP 429/503 responses back off,
+        honouring Retry-After when present (exponential otherwise). A snapshot
+        that was running is not re-fetched within running_ttl seconds, and is
+        re-polled with If-None-Match so an unchanged one costs a bodyless 304.
+        
         Args:
             snapshot_id: The snapshot ID to retrieve
+            max_retries: Retries after a 429/503 response (default 3)
             
         Returns:
             Tuple of (JSON response data or None if failed, is_still_running boolean, is_valid boolean, error_reason string)
         """
-        import json
-        
         try:
-            # Extract base URL from trigger URL and construct snapshot URL
-            base_url = self.url.split('/trigger')[0] if '/trigger' in self.url else 'https://api.brightdata.com/datasets/v3'
-            url = f"{base_url}/snapshot/{snapshot_id}?format=json"
+            if self._running_until.get(snapshot_id, 0) > time.monotonic():
+                return None, True, False, "Status is running (cached)"
+            
+            url = self.snapshot_base + snapshot_id
+            etag = self._etags.get(snapshot_id)
+            headers = {'If-None-Match': etag} if etag else None
+            
+            for attempt in range(max_retries + 1):
+                if self.rate_limiter:
+                    self.rate_limiter.take()
+                response = self.session.get(url, params=self.SNAPSHOT_PARAMS, headers=headers, timeout=30)
+                if response.status_code not in (429, 503) or attempt == max_retries:
+                    break
+                
+                # Rate limited: wait as instructed by the server, then retry
+                try:
+                    retry_after = float(response.headers.get('Retry-After', ''))
+                except ValueError:
+                    retry_after = -1
+                if not math.isfinite(retry_after) or retry_after < 0:
+                    retry_after = 2 ** attempt
+                retry_after = min(retry_after, self.MAX_RETRY_AFTER)
+                logger.warning(f"Snapshot {snapshot_id}: HTTP {response.status_code}, retrying in {retry_after}s")
+                time.sleep(retry_after)
             
-            response = requests.get(
-                url,
-                headers=self.headers,
-                timeout=30
-            )
             response.raise_for_status()
             
-            data = response.json()
+            # ETags are only kept for running payloads, so 304 means still running
+            if response.status_code == 304:
+                self._remember_running(snapshot_id)
+                return None, True, False, "Status is running (not modified)"
+            
+            # 202 Accepted means the snapshot is still being built; its small
+            # status body carries nothing to save, so skip decoding it
+            if response.status_code == 202:
+                logger.warning(f"Snapshot {snapshot_id} not ready (HTTP 202) - invalid response")
+                self._remember_running(snapshot_id, response.headers.get('ETag'))
+                return None, True, False, "Status is running"
+            
+            body = response.content
+            data = orjson.loads(body)
 
             # Validate response
             # New rule: Only treat status="running" as invalid. Do not invalidate
@@ -78,11 +263,24 @@ class BrightdataClient:
             is_valid = True
             error_reason = ""
 
-            data_str = json.dumps(data)
-            if '"status":"running"' in data_str or '"status": "running"' in data_str:
+            # Inspect the parsed payload directly: Brightdata reports a pending
+            # snapshot as {"status": "running", ...} (list-shaped payloads per item)
+            if isinstance(data, dict):
+                is_running_payload = data.get('status') == 'running'
+            elif isinstance(data, list) and _STATUS_RUNNING_RE.search(body):
+                # Confirm structurally only when the marker appears in the raw bytes
+                is_running_payload = any(isinstance(d, dict) and d.get('status') == 'running' for d in data)
+            else:
+                is_running_payload = False
+
+            if is_running_payload:
                 is_valid = False
                 error_reason = "Status is running"
                 logger.warning(f"Snapshot {snapshot_id} has status 'running' - invalid response")
+                self._remember_running(snapshot_id, response.headers.get('ETag'))
+            else:
+                self._etags.pop(snapshot_id, None)
+                self._running_until.pop(snapshot_id, None)
 
             # For backward compatibility: is_running = True if status is running
             is_running = not is_valid and "running" in error_reason
@@ -99,7 +297,7 @@ class BrightdataClient:
             logger.error(f"Error decoding response for snapshot {snapshot_id}: {e}")
             return None, False, False, f"JSON decode error: {str(e)}"
     
-    def create_payload(self, keywords: List[str]) -> str:
+    def create_payload(self, keywords: List[str]) -> bytes:
         """
         Create payload for Brightdata API request
         
@@ -107,21 +305,10 @@ class BrightdataClient:
             keywords: List of search keywords/queries
             
         Returns:
-            JSON string payload
-        """
-        input_data = []
-        for keyword in keywords:
-            input_data.append({
-                "url": "https://www.google.com/",
-                "keyword": keyword,
-                "language": "",
-                "uule": "",
-                "brd_mobile": ""
-            })
-        
-        payload_dict = {"input": input_data}
-        payload = json.dumps(payload_dict)
-        return payload
+            JSON payload as UTF-8 bytes (sent as the request body unchanged)
+        """
+        items = b','.join(_PAYLOAD_ITEM_TEMPLATE % orjson.dumps(keyword) for keyword in keywords)
+        return b'{"input":[' + items + b']}'
     
     def send_request(self, keywords: List[str]) -> Optional[Dict]:
         """
@@ -135,9 +322,8 @@ class BrightdataClient:
         """
         try:
             payload = self.create_payload(keywords)
-            response = requests.post(
+            response = self.session.post(
                 self.url,
-                headers=self.headers,
                 data=payload,
                 timeout=30
             )
@@ -165,7 +351,18 @@ class SupabaseClient:
     """Client for interacting with Supabase"""
     
     def __init__(self, url: str, key: str):
-        self.client: Client = create_client(url, key)
+        # One keep-alive HTTP/2 pool shared by every table/RPC call (and by
+        # worker threads); failed connection attempts are retried by the transport
+        self.http_client = httpx.Client(
+            transport=httpx.HTTPTransport(
+                http2=True,
+                retries=3,
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+            ),
+            timeout=120,
+            follow_redirects=True,
+        )
+        self.client: Client = create_client(url, key, options=ClientOptions(httpx_client=self.http_client))
     
     def save_snapshot(self, snapshot_id: str, queries: List[str] = None) -> bool:
         """
@@ -193,32 +390,62 @@ class SupabaseClient:
             logger.error(f"Error saving snapshot to Supabase: {e}")
             return False
     
-    def get_all_existing_queries(self) -> List[str]:
+    def get_all_existing_queries(self) -> Set[str]:
         """
-        Get all unique queries from snapshot_table (flattened and lowercase)
+        Get all unique queries from snapshot_table (flattened and casefolded)
         
         Returns:
-            List of lowercase queries for case-insensitive comparison
+            Set of casefolded queries for case-insensitive comparison
         """
         try:
             response = self.client.table('snapshot_table').select('query').execute()
             
-            all_queries = []
-            if response.data:
-                for row in response.data:
-                    queries = row.get('query', [])
-                    if queries:
-                        # Flatten and convert to lowercase
-                        all_queries.extend([q.lower().strip() for q in queries if q])
-            
-            # Return unique queries
-            unique_queries = list(set(all_queries))
+            # Flatten, casefold (Unicode-aware lowercase) and dedupe in one pass
+            unique_queries = {
+                q.casefold().strip()
+                for row in (response.data or [])
+                for q in (row.get('query') or [])
+                if q
+            }
             logger.info(f"Found {len(unique_queries)} unique queries in database")
             return unique_queries
             
         except Exception as e:
             logger.error(f"Error fetching existing queries: {e}")
-            return []
+            return set()
+    
+    def find_existing_queries(self, candidates: List[str]) -> Optional[Set[str]]:
+        """
+        Find which candidate queries already exist in snapshot_table
+        
+        Matching runs in Postgres through the find_existing_queries function
+        (see database_migration.sql), so only the intersection is downloaded
+        instead of every stored query. Postgres has no casefold(), so both
+        the lower() and casefold() forms of each candidate are sent and the
+        matches are casefolded again on the way back. All candidates go in
+        one call (the RPC body is JSON, so there is no URL length limit),
+        since each call scans snapshot_table once.
+        
+        Args:
+            candidates: Queries to check
+            
+        Returns:
+            Set of casefolded candidate queries that already exist, or None if
+            the lookup failed (an empty set would claim every query is new)
+        """
+        try:
+            stripped = {q.strip() for q in candidates if q and q.strip()}
+            lookup = list({q.lower() for q in stripped} | {q.casefold() for q in stripped})
+            
+            response = self.client.rpc('find_existing_queries', {'candidates': lookup}).execute()
+            existing = {row['query'].casefold().strip() for row in response.data or [] if row.get('query')}
+            
+            logger.info(f"Found {len(existing)}/{len(stripped)} candidate queries in database")
+            return existing
+            
+        except Exception as e:
+            logger.error(f"Error finding existing queries: {e}")
+            return None
     
     def get_unprocessed_snapshots(self) -> List[Dict]:
         """
@@ -257,6 +484,28 @@ class SupabaseClient:
             logger.error(f"Error marking snapshot as processed: {e}")
             return False
     
+    def mark_as_processed_bulk(self, snapshot_ids: List[str], chunk_size: int = 500) -> bool:
+        """
+        Mark multiple snapshots as processed with one UPDATE ... IN per chunk
+        
+        Args:
+            snapshot_ids: The snapshot IDs to mark as processed
+            chunk_size: IDs per update request, keeps the URL short (default 500)
+            
+        Returns:
+            True if successful, False otherwise
+        """
+        try:
+            for i in range(0, len(snapshot_ids), chunk_size):
+                chunk = snapshot_ids[i:i + chunk_size]
+                self.client.table('snapshot_table').update({'processed': True}).in_('snapshot_id', chunk).execute()
+            logger.info(f"Marked {len(snapshot_ids)} snapshots as processed")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error marking snapshots as processed: {e}")
+            return False
+    
     def save_email(self, email: str) -> tuple[bool, str]:
         """
         Save a single email to Supabase email_table
@@ -276,15 +525,47 @@ class SupabaseClient:
             return True, ''
             
         except Exception as e:
-            error_str = str(e)
             # Check if it's a duplicate key error
-            if 'duplicate' in error_str.lower() or 'unique' in error_str.lower():
+            if _is_unique_violation(e):
                 logger.warning(f"Duplicate email {email}")
                 return False, 'duplicate'
             else:
                 logger.error(f"Error saving email to Supabase: {e}")
                 return False, 'error'
     
+    def save_emails_bulk(self, emails: List[str], chunk_size: int = 1000) -> tuple[int, int, int]:
+        """
+        Save multiple emails to Supabase email_table in chunked upserts
+        
+        Emails are lowercased and de-duplicated first. Existing emails are
+        ignored by the database (on conflict do nothing), so only newly
+        inserted rows are returned.
+        
+        Args:
+            emails: Email addresses to save
+            chunk_size: Rows per upsert request (default 1000)
+            
+        Returns:
+            Tuple of (saved: int, duplicates: int, failed: int)
+        """
+        unique_emails = list(dict.fromkeys(email.lower() for email in emails))
+        saved = 0
+        failed = 0
+        
+        for i in range(0, len(unique_emails), chunk_size):
+            chunk = unique_emails[i:i + chunk_size]
+            try:
+                data = [{'email': email} for email in chunk]
+                response = self.client.table('email_table').upsert(data, on_conflict='email', ignore_duplicates=True).execute()
+                saved += len(response.data) if response.data else 0
+            except Exception as e:
+                logger.error(f"Error saving emails to Supabase: {e}")
+                failed += len(chunk)
+        
+        if unique_emails:
+            logger.info(f"Saved {saved}/{len(emails)} emails to Supabase")
+        return saved, len(emails) - saved - failed, failed
+    
     def save_response(self, snapshot_id: str, response_data: dict) -> tuple[bool, str]:
         """
         Save snapshot response to Supabase response_table
@@ -309,31 +590,117 @@ class SupabaseClient:
             return True, ''
             
         except Exception as e:
-            error_str = str(e)
             # Check if it's a duplicate key error
-            if 'duplicate' in error_str.lower() or 'unique' in error_str.lower():
+            if _is_unique_violation(e):
                 logger.warning(f"Duplicate snapshot {snapshot_id}")
                 return False, 'duplicate'
             else:
                 logger.error(f"Error saving response to Supabase: {e}")
                 return False, 'error'
     
-    def get_unextracted_responses(self, limit: int = 20, offset: int = 0) -> List[Dict]:
+    def save_responses_bulk(self, responses: List[tuple[str, dict]], chunk_size: int = 20) -> tuple[int, int, int]:
+        """
+        Save multiple snapshot responses to response_table in chunked upserts
+        
+        Snapshots that already have a response are ignored by the database
+        (on conflict do nothing), so only newly inserted rows are returned.
+        Chunks are kept small because each row carries a full snapshot payload.
+        
+        Args:
+            responses: List of (snapshot_id, response_data) tuples
+            chunk_size: Rows per upsert request (default 20)
+            
+        Returns:
+            Tuple of (saved: int, duplicates: int, failed: int)
+        """
+        data = [
+            {'snapshot_id': snapshot_id, 'response': response_data, 'is_email_extracted': False}
+            for snapshot_id, response_data in dict(responses).items()
+        ]
+        saved = 0
+        failed = 0
+        
+        for i in range(0, len(data), chunk_size):
+            chunk = data[i:i + chunk_size]
+            try:
+                response = self.client.table('response_table').upsert(chunk, on_conflict='snapshot_id', ignore_duplicates=True).execute()
+                saved += len(response.data) if response.data else 0
+            except Exception as e:
+                logger.error(f"Error saving responses to Supabase: {e}")
+                failed += len(chunk)
+        
+        if data:
+            logger.info(f"Saved {saved}/{len(responses)} responses to Supabase")
+        return saved, len(responses) - saved - failed, failed
+    
+    def ingest_snapshots(self, responses: List[tuple[str, dict]], chunk_size: int = 20) -> tuple[int, int, int]:
+        """
+        Save snapshot responses and mark their snapshots processed in one call per chunk
+        
+        Runs the ingest_snapshots function (see database_migration.sql), so
+        each chunk is inserted into response_table and flipped to processed
+        in snapshot_table within a single transaction and round trip.
+        
+        Args:
+            responses: List of (snapshot_id, response_data) tuples
+            chunk_size: Snapshots per RPC call (default 20)
+            
+        Returns:
+            Tuple of (saved: int, duplicates: int, failed: int)
+        """
+        items = [
+            {'snapshot_id': snapshot_id, 'response': response_data}
+            for snapshot_id, response_data in dict(responses).items()
+        ]
+        saved = 0
+        failed = 0
+        
+        for i in range(0, len(items), chunk_size):
+            chunk = items[i:i + chunk_size]
+            try:
+                response = self.client.rpc('ingest_snapshots', {'items': chunk}).execute()
+                saved += response.data or 0
+            except Exception as e:
+                logger.error(f"Error ingesting snapshots to Supabase: {e}")
+                failed += len(chunk)
+        
+        if items:
+            logger.info(f"Ingested {saved}/{len(responses)} snapshot responses to Supabase")
+        return saved, len(responses) - saved - failed, failed
+    
+    def get_unextracted_responses(self, limit: int = 20, after_snapshot_id: str | None = None) -> List[Dict]:
         """
         Get responses from response_table where emails haven't been extracted yet
         
+        Rows are ordered by snapshot_id and paged by keyset: pass the last
+        snapshot_id of the previous page to get the rows after it.
+        
         Args:
             limit: Maximum number of rows to fetch (default 20)
-            offset: Number of rows to skip (default 0)
+            after_snapshot_id: Last snapshot_id of the previous page (optional)
             
         Returns:
             List of dictionaries with snapshot_id and response data
         """
         try:
-            response = self.client.table('response_table').select('snapshot_id, response').eq('is_email_extracted', False).range(offset, offset + limit - 1).execute()
+            # Sent on the pooled HTTP client and decoded with orjson: rows carry
+            # full snapshot payloads, and postgrest-py validates every nested
+            # JSON value through pydantic, which costs far more than the parse
+            params = {
+                'select': 'snapshot_id,response',
+                'is_email_extracted': 'eq.false',
+                'order': 'snapshot_id',
+                'limit': limit,
+            }
+            if after_snapshot_id is not None:
+                params['snapshot_id'] = f'gt.{after_snapshot_id}'
+            
+            postgrest = self.client.postgrest
+            response = self.http_client.get(f"{postgrest.base_url}/response_table", params=params, headers=postgrest.headers)
+            response.raise_for_status()
             
-            rows = response.data if response.data else []
-            logger.info(f"Found {len(rows)} unextracted responses (limit: {limit}, offset: {offset})")
+            rows = orjson.loads(response.content) or []
+            logger.info(f"Found {len(rows)} unextracted responses (limit: {limit}, after: {after_snapshot_id})")
             return rows
             
         except Exception as e:
@@ -348,8 +715,10 @@ class SupabaseClient:
             Count of rows where is_email_extracted = false
         """
         try:
-            # Use CountMethod.exact to get count efficiently without fetching data
-            response = self.client.table('response_table').select('*', count=CountMethod.exact).eq('is_email_extracted', False).limit(0).execute()
+            # HEAD request with CountMethod.exact: only the Content-Range count comes back, no rows.
+            # With the partial index idx_response_unextracted (database_migration.sql, Step 6)
+            # Postgres answers this from the index alone.
+            response = self.client.table('response_table').select('snapshot_id', count=CountMethod.exact, head=True).eq('is_email_extracted', False).execute()
             
             count = response.count if hasattr(response, 'count') and response.count is not None else 0
             logger.info(f"Total unextracted responses: {count}")
@@ -359,6 +728,31 @@ class SupabaseClient:
             logger.error(f"Error counting unextracted responses: {e}")
             return 0
     
+    def extract_emails_batch(self, batch_size: int = 100) -> tuple[int, int]:
+        """
+        Extract emails from a batch of unextracted responses inside Postgres
+        
+        Runs the extract_emails_batch function (see database_migration.sql):
+        the regex runs in the database and response JSON never leaves it.
+        
+        Args:
+            batch_size: Maximum number of responses to process (default 100)
+            
+        Returns:
+            Tuple of (rows_processed: int, emails_saved: int); (0, 0) on error
+        """
+        try:
+            response = self.client.rpc('extract_emails_batch', {'batch_size': batch_size}).execute()
+            row = response.data[0] if response.data else {}
+            rows_processed = row.get('rows_processed') or 0
+            emails_saved = row.get('emails_saved') or 0
+            logger.info(f"Extracted {emails_saved} new emails from {rows_processed} responses in Postgres")
+            return rows_processed, emails_saved
+            
+        except Exception as e:
+            logger.error(f"Error extracting emails in Postgres: {e}")
+            return 0, 0
+    
     def mark_email_extracted(self, snapshot_id: str) -> bool:
         """
         Mark a response row as email extracted
@@ -378,10 +772,35 @@ class SupabaseClient:
             logger.error(f"Error marking snapshot as extracted: {e}")
             return False
     
+    def mark_emails_extracted_bulk(self, snapshot_ids: List[str], chunk_size: int = 500) -> bool:
+        """
+        Mark multiple response rows as email extracted with one UPDATE ... IN per chunk
+        
+        Args:
+            snapshot_ids: The snapshot_ids (primary keys) in response_table
+            chunk_size: IDs per update request, keeps the URL short (default 500)
+            
+        Returns:
+            True if successful, False otherwise
+        """
+        try:
+            for i in range(0, len(snapshot_ids), chunk_size):
+                chunk = snapshot_ids[i:i + chunk_size]
+                self.client.table('response_table').update({'is_email_extracted': True}).in_('snapshot_id', chunk).execute()
+            logger.info(f"Marked {len(snapshot_ids)} snapshots as email extracted")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error marking snapshots as extracted: {e}")
+            return False
+    
     def get_emails_by_date(self, start_date: str | None = None, end_date: str | None = None) -> List[Dict]:
         """
         Get all emails from email_table with optional date filtering
         
+        Prefer iter_emails_by_date / get_emails_by_date_paged for large
+        exports; this materializes every row.
+        
         Args:
             start_date: Start date in YYYY-MM-DD format (optional)
             end_date: End date in YYYY-MM-DD format (optional)
@@ -390,28 +809,79 @@ class SupabaseClient:
             List of dictionaries with email data
         """
         try:
-            query = self.client.table('email_table').select('*')
+            return list(self.iter_emails_by_date(start_date, end_date, columns='*'))
+        except Exception:
+            # Already logged by get_emails_by_date_paged; no partial list
+            return []
+    
+    def iter_emails_by_date(self, start_date: str | None = None, end_date: str | None = None,
+                            page_size: int = 1000, columns: str = 'email, created_at') -> Iterator[Dict]:
+        """
+        Yield emails from email_table one row at a time with optional date filtering
+        
+        Memory stays bounded by one page; see get_emails_by_date_paged.
+        
+        Args:
+            start_date: Start date in YYYY-MM-DD format (optional)
+            end_date: End date in YYYY-MM-DD format (optional)
+            page_size: Rows per request (default 1000)
+            columns: Columns to select (default 'email, created_at')
+            
+        Yields:
+            Dictionaries with email data
+        """
+        for page in self.get_emails_by_date_paged(start_date, end_date, page_size, columns):
+            yield from page
+    
+    def get_emails_by_date_paged(self, start_date: str | None = None, end_date: str | None = None,
+                                 page_size: int = 1000, columns: str = 'email, created_at') -> Iterator[List[Dict]]:
+        """
+        Yield emails from email_table page by page with optional date filtering
+        
+        Uses range pagination so callers can render rows as they arrive and
+        results are not capped at PostgREST's max-rows limit.
+        
+        Args:
+            start_date: Start date in YYYY-MM-DD format (optional)
+            end_date: End date in YYYY-MM-DD format (optional)
+            page_size: Rows per request (default 1000)
+            columns: Columns to select (default 'email, created_at')
+            
+        Yields:
+            Lists of dictionaries with email data
             
-            # Apply date filters if provided
-            if start_date:
-                query = query.gte('created_at', start_date)
+        Raises:
+            Exception: Errors are logged and re-raised, so a failure mid-way
+                is not mistaken for the end of the results
+        """
+        try:
+            end_bound = None
             if end_date:
                 # Add one day to include the entire end_date
-                from datetime import datetime, timedelta
-                end_datetime = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
-                query = query.lt('created_at', end_datetime.strftime('%Y-%m-%d'))
+                end_bound = (datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
             
-            # Order by created_at descending
-            query = query.order('created_at', desc=True)
+            offset = 0
+            while True:
+                query = self.client.table('email_table').select(columns)
+                if start_date:
+                    query = query.gte('created_at', start_date)
+                if end_bound:
+                    query = query.lt('created_at', end_bound)
+                
+                # Order by created_at descending; email breaks ties so pages don't overlap
+                response = query.order('created_at', desc=True).order('email').range(offset, offset + page_size - 1).execute()
+                rows = response.data if response.data else []
+                if rows:
+                    yield rows
+                if len(rows) < page_size:
+                    break
+                offset += page_size
             
-            response = query.execute()
-            rows = response.data if response.data else []
-            logger.info(f"Found {len(rows)} emails")
-            return rows
+            logger.info(f"Found {offset + len(rows)} emails")
             
         except Exception as e:
             logger.error(f"Error fetching emails: {e}")
-            return []
+            raise
 
 
 class EmailScraperEngine:
@@ -421,54 +891,95 @@ class EmailScraperEngine:
         self.brightdata = brightdata_client
         self.supabase = supabase_client
     
-    def process_queries(self, queries: List[str], batch_size: int = 2) -> Dict[str, any]:
+    def _submit_batch(self, batch_number: int, batch: List[str], limiter: Optional[TokenBucket]) -> Optional[str]:
+        """
+        Send one batch to Brightdata and save its snapshot to Supabase
+        
+        Args:
+            batch_number: 1-based batch number (for logging)
+            batch: Queries in this batch
+            limiter: Rate limiter shared by all workers (None for no pacing)
+            
+        Returns:
+            Saved snapshot_id or None if the batch failed
+        """
+        if limiter:
+            limiter.take()
+        
+        logger.info(f"Processing batch {batch_number} ({len(batch)} queries): {batch}")
+        
+        # Send request to Brightdata
+        response = self.brightdata.send_request(batch)
+        
+        if response and 'snapshot_id' in response:
+            snapshot_id = response['snapshot_id']
+            
+            # Save to Supabase with query array
+            if self.supabase.save_snapshot(snapshot_id, batch):
+                return snapshot_id
+        else:
+            logger.warning(f"Batch {batch_number} failed: No snapshot_id in response")
+        
+        return None
+    
+    def process_queries(self, queries: List[str], batch_size: int = 2, max_workers: int = 8,
+                        request_delay: float = 2,
+                        progress_callback: Optional[Callable[[int, int], None]] = None) -> Dict[str, any]:
         """
         Process search queries in batches and save snapshots to Supabase
         
+        Batches are independent, so up to max_workers of them are sent to
+        Brightdata concurrently. Requests are paced by a token bucket allowing
+        max_workers requests per request_delay seconds, so workers only wait
+        when the request rate would actually exceed that.
+        
         Args:
             queries: List of search queries to process
             batch_size: Number of queries per batch (default: 2)
+            max_workers: Maximum concurrent Brightdata requests (default: 8)
+            request_delay: Average seconds between requests of one worker (default: 2)
+            progress_callback: Optional callable(completed_batches, total_batches),
+                invoked from the calling thread as batches finish
             
         Returns:
             Dictionary with statistics about processed queries
         """
         total_queries = len(queries)
-        successful_snapshots = 0
-        failed_batches = 0
-        batch_count = 0
-        submitted_ids = []
-        snapshot_query_map = {}  # Maps snapshot_id to queries
+        batches = [queries[i:i + batch_size] for i in range(0, total_queries, batch_size)]
+        batch_count = len(batches)
+        results: List[Optional[str]] = [None] * batch_count
         
-        logger.info(f"Starting to process {total_queries} queries with batch size {batch_size}")
+        logger.info(f"Starting to process {total_queries} queries with batch size {batch_size} ({max_workers} workers)")
         
-        # Process queries in batches
-        for i in range(0, total_queries, batch_size):
-            batch_count += 1
-            batch = queries[i:i + batch_size]
-            current_batch_size = len(batch)
-            
-            logger.info(f"Processing batch {batch_count} ({current_batch_size} queries): {batch}")
-            
-            # Send request to Brightdata
-            response = self.brightdata.send_request(batch)
-            
-            if response and 'snapshot_id' in response:
-                snapshot_id = response['snapshot_id']
+        if batches:
+            # The first wave of batches starts immediately (full bucket); later batches are paced
+            limiter = TokenBucket(max_workers / request_delay, capacity=max_workers) if request_delay > 0 else None
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    executor.submit(self._submit_batch, idx + 1, batch, limiter): idx
+                    for idx, batch in enumerate(batches)
+                }
                 
-                # Save to Supabase with query array
-                if self.supabase.save_snapshot(snapshot_id, batch):
-                    successful_snapshots += 1
-                    submitted_ids.append(snapshot_id)
-                    snapshot_query_map[snapshot_id] = batch
-                else:
-                    failed_batches += 1
-            else:
-                logger.warning(f"Batch {batch_count} failed: No snapshot_id in response")
-                failed_batches += 1
-            
-            # Add delay between requests to avoid rate limiting
-            if i + current_batch_size < total_queries:
-                time.sleep(2)
+                for completed, future in enumerate(as_completed(futures), 1):
+                    idx = futures[future]
+                    try:
+                        results[idx] = future.result()
+                    except Exception as e:
+                        logger.error(f"Batch {idx + 1} failed: {e}")
+                    
+                    if progress_callback:
+                        progress_callback(completed, batch_count)
+        
+        # Collect results in batch order
+        submitted_ids = []
+        snapshot_query_map = {}  # Maps snapshot_id to queries
+        for batch, snapshot_id in zip(batches, results):
+            if snapshot_id:
+                submitted_ids.append(snapshot_id)
+                snapshot_query_map[snapshot_id] = batch
+        
+        successful_snapshots = len(submitted_ids)
+        failed_batches = batch_count - successful_snapshots
         
         statistics = {
             'total_queries': total_queries,
@@ -56,11 +56,14 @@ def main():
         "Content-Type": "application/json",
     }
 
+    # Serialize once; the same body is printed and sent
+    body = json.dumps(payload)
+
     print("POST", url)
-    print("Payload:", json.dumps(payload)[:500] + ("..." if len(json.dumps(payload)) > 500 else ""))
+    print("Payload:", body[:500] + ("..." if len(body) > 500 else ""))
 
     try:
-        resp = requests.post(url, headers=headers, data=json.dumps(payload), timeout=30)
+        resp = requests.post(url, headers=headers, data=body, timeout=30)
         print("Status:", resp.status_code)
         ct = resp.headers.get("Content-Type", "")
         text = resp.text
@@ -1,18 +1,30 @@
 import os
-import json
 import threading
 import time
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse
 from dotenv import load_dotenv
+import orjson
+import requests
 
-from email_scraper import BrightdataClient, SupabaseClient, logger
+from email_scraper import BrightdataClient, SupabaseClient, TokenBucket, logger
 
 
 class Stage2Service:
+    # Concurrent Brightdata fetches per run
+    MAX_WORKERS = 16
+    # Fetched responses saved per bulk upsert
+    SAVE_BATCH = 20
+    # Snapshots seen running are not re-polled for this many seconds
+    RUNNING_RECHECK_SECONDS = 60
+    # Sustained Brightdata snapshot downloads per second across all workers
+    MAX_REQUESTS_PER_SECOND = 10
+
     def __init__(self):
         load_dotenv()
         self._stop = threading.Event()
+        self._health_cache = None  # (stats dict, stop flag, serialized /health body)
         self.stats = {
             "last_run_started": None,
             "last_run_finished": None,
@@ -28,52 +40,88 @@ class Stage2Service:
         supabase_key = os.getenv("SUPABASE_KEY") or ""
         if not api_key or not brightdata_url or not supabase_url or not supabase_key:
             raise RuntimeError("Missing environment variables for Stage2Service")
-        self.brightdata = BrightdataClient(api_key, brightdata_url)
+        self.brightdata = BrightdataClient(
+            api_key,
+            brightdata_url,
+            running_ttl=self.RUNNING_RECHECK_SECONDS,
+            rate_limiter=TokenBucket(self.MAX_REQUESTS_PER_SECOND, capacity=self.MAX_WORKERS),
+        )
         self.supabase = SupabaseClient(supabase_url, supabase_key)
+        # Optional Stage 3 /notify endpoint, pinged when new responses are saved
+        self.stage3_notify_url = (os.getenv("STAGE3_NOTIFY_URL") or "").strip()
 
     def run_once(self):
-        self.stats.update({
+        # Counters live in a run-local dict tallied on this thread only; readers
+        # get copies published by swapping self.stats, never a dict in flux
+        stats = {
             "last_run_started": time.time(),
+            "last_run_finished": self.stats.get("last_run_finished"),
             "processed": 0,
             "saved": 0,
             "skipped": 0,
             "failed": 0,
             "invalid": 0,
-        })
+        }
+        self.stats = dict(stats)
         snapshots = self.supabase.get_unprocessed_snapshots() or []
-        for s in snapshots:
-            if self._stop.is_set():
-                break
-            snapshot_id = s.get("snapshot_id")
-            try:
-                data, is_running, is_valid, error_reason = self.brightdata.get_snapshot_data(snapshot_id)
-                self.stats["processed"] += 1
-                if not is_valid:
-                    self.stats["invalid"] += 1
-                    logger.warning(f"Stage2 invalid snapshot {snapshot_id}: {error_reason}")
-                    # leave unprocessed for retry later
-                    continue
-                if not data:
-                    self.stats["skipped"] += 1
-                    logger.info(f"Stage2 no data for {snapshot_id}")
-                    continue
-                ok, err = self.supabase.save_response(snapshot_id, data)
-                if ok:
-                    self.supabase.mark_as_processed(snapshot_id)
-                    self.stats["saved"] += 1
-                    logger.info(f"Stage2 saved response for {snapshot_id}")
-                elif err == "duplicate":
-                    self.supabase.mark_as_processed(snapshot_id)
-                    self.stats["skipped"] += 1
-                    logger.info(f"Stage2 duplicate response for {snapshot_id}")
-                else:
-                    self.stats["failed"] += 1
-                    logger.error(f"Stage2 failed saving {snapshot_id}")
-            except Exception as e:
-                self.stats["failed"] += 1
-                logger.exception(f"Stage2 error {snapshot_id}: {e}")
-            time.sleep(0.2)
-        self.stats["last_run_finished"] = time.time()
+        to_save = []
+        with ThreadPoolExecutor(max_workers=self.MAX_WORKERS) as executor:
+            futures = [executor.submit(self._process_one, s.get("snapshot_id")) for s in snapshots]
+            # Save in bulk as results arrive, in completion order
+            for future in as_completed(futures):
+                outcome, result = future.result()
+                if outcome in ("ok", "invalid", "skipped"):
+                    stats["processed"] += 1
+                if outcome == "ok":
+                    to_save.append(result)
+                elif outcome != "stopped":
+                    stats[outcome] += 1
+                if len(to_save) >= self.SAVE_BATCH:
+                    self._save_window(to_save, stats)
+                    to_save = []
+                self.stats = dict(stats)
+        self._save_window(to_save, stats)
+        stats["last_run_finished"] = time.time()
+        self.stats = stats
+        if stats["saved"] and self.stage3_notify_url:
+            self._notify_stage3()
+
+    def _notify_stage3(self):
+        # Best effort: Stage 3 still polls on its interval if this is missed
+        try:
+            requests.post(self.stage3_notify_url, timeout=5)
+        except requests.RequestException as e:
+            logger.warning(f"Stage2 could not notify Stage3: {e}")
+
+    def _save_window(self, to_save, stats):
+        if not to_save:
+            return
+        # Saves the responses and marks their snapshots processed in one transaction
+        saved, duplicates, failed = self.supabase.ingest_snapshots(to_save)
+        stats["saved"] += saved
+        stats["skipped"] += duplicates
+        stats["failed"] += failed
+        if failed:
+            logger.error(f"Stage2 failed saving {failed} of {len(to_save)} responses")
+        logger.info(f"Stage2 saved {saved} responses ({duplicates} duplicates)")
+
+    def _process_one(self, snapshot_id):
+        # Runs on a worker thread; returns (outcome, (snapshot_id, data) or None)
+        if self._stop.is_set():
+            return "stopped", None
+        try:
+            data, is_running, is_valid, error_reason = self.brightdata.get_snapshot_data(snapshot_id)
+            if not is_valid:
+                logger.warning(f"Stage2 invalid snapshot {snapshot_id}: {error_reason}")
+                # leave unprocessed for retry later
+                return "invalid", None
+            if not data:
+                logger.info(f"Stage2 no data for {snapshot_id}")
+                return "skipped", None
+            return "ok", (snapshot_id, data)
+        except Exception as e:
+            logger.exception(f"Stage2 error {snapshot_id}: {e}")
+            return "failed", None
 
     def loop(self, interval_seconds: int = 30):
         logger.info("Stage2 server loop started")
@@ -85,31 +133,46 @@ class Stage2Service:
                 time.sleep(1)
         logger.info("Stage2 server loop stopped")
 
+    def health_body(self):
+        # Serialized once per published stats dict (run_once swaps rather than
+        # mutates it), so repeated polls between updates reuse the same bytes
+        stats, stop_requested = self.stats, self._stop.is_set()
+        cached = self._health_cache
+        if cached is None or cached[0] is not stats or cached[1] != stop_requested:
+            body = orjson.dumps({"status": "ok", "stats": stats, "stop_requested": stop_requested})
+            cached = self._health_cache = (stats, stop_requested, body)
+        return cached[2]
+
     def stop(self):
         self._stop.set()
+        self.brightdata.close()
 
 
 class Stage2Handler(BaseHTTPRequestHandler):
     service: Stage2Service = None  # injected
+    # Keep-alive: pollers reuse one connection instead of reconnecting per request
+    protocol_version = "HTTP/1.1"
 
     def _json(self, code: int, payload: dict):
+        self._send(code, orjson.dumps(payload))
+
+    def _send(self, code: int, body: bytes):
         self.send_response(code)
         self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
         self.end_headers()
-        self.wfile.write(json.dumps(payload).encode("utf-8"))
+        self.wfile.write(body)
 
     def do_GET(self):
         path = urlparse(self.path).path
         if path == "/health":
-            self._json(200, {
-                "status": "ok",
-                "stats": Stage2Handler.service.stats,
-                "stop_requested": Stage2Handler.service._stop.is_set(),
-            })
+            self._send(200, Stage2Handler.service.health_body())
         else:
             self._json(404, {"error": "not_found"})
 
     def do_POST(self):
+        # Drain any request body so the next request on this connection parses cleanly
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
         path = urlparse(self.path).path
         if path == "/run-once":
             threading.Thread(target=Stage2Handler.service.run_once, daemon=True).start()
@@ -124,7 +187,8 @@ class Stage2Handler(BaseHTTPRequestHandler):
 def main(host: str = "0.0.0.0", port: int = 9002, interval: int = 30):
     service = Stage2Service()
     Stage2Handler.service = service
-    server = HTTPServer((host, port), Stage2Handler)
+    # One thread per request, so /health answers while /run-once is busy
+    server = ThreadingHTTPServer((host, port), Stage2Handler)
     loop_thread = threading.Thread(target=service.loop, args=(interval,), daemon=True)
     loop_thread.start()
     logger.info(f"Stage2 HTTP server on {host}:{port}")
@@ -1,30 +1,32 @@
 import os
-import json
 import threading
 import time
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse
 from dotenv import load_dotenv
+import orjson
 
-from email_scraper import SupabaseClient, logger
-
-
-def extract_emails_from_text(text: str) -> list:
-    import re
-    pat = r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b"
-    return list(set(re.findall(pat, text)))
-
-
-def extract_emails_from_json(json_data) -> list:
-    import json as _json
-    s = _json.dumps(json_data)
-    return extract_emails_from_text(s)
+from email_scraper import SupabaseClient, extract_emails_from_json, logger
 
 
 class Stage3Service:
+    # Bound on remembered emails; the set is reset once it grows past this
+    SEEN_EMAILS_MAX = 500_000
+    # Batches processed concurrently per run (each is Supabase-latency bound)
+    PARALLEL_BATCHES = 4
+    # After a wakeup, wait this long so a burst of inserts coalesces into one run
+    WAKE_DEBOUNCE_SECONDS = 2
+
     def __init__(self):
         load_dotenv()
         self._stop = threading.Event()
+        # Set by notify() (POST /notify) when new responses are saved
+        self._wake = threading.Event()
+        self._health_cache = None  # (stats dict, stop flag, serialized /health body)
+        # Lowercased emails already saved by this process (skip the round trip)
+        self._seen_emails = set()
+        self._seen_lock = threading.Lock()
         self.stats = {
             "last_run_started": None,
             "last_run_finished": None,
@@ -38,82 +40,160 @@ class Stage3Service:
         if not supabase_url or not supabase_key:
             raise RuntimeError("Missing environment variables for Stage3Service")
         self.supabase = SupabaseClient(supabase_url, supabase_key)
+        # Opt-in: run extraction in Postgres (needs extract_emails_batch from
+        # database_migration.sql) instead of fetching responses into Python
+        self.sql_extraction = os.getenv("STAGE3_SQL_EXTRACTION", "").strip() == "1"
 
     def run_once(self, batch_size: int = 20):
-        self.stats.update({
+        # Returns True when the run stopped at its page cap with every batch
+        # saved, i.e. a backlog remains that can be drained right away.
+        # Counters are tallied in a run-local dict; readers get copies published
+        # by swapping self.stats, so a published dict never changes
+        stats = {
             "last_run_started": time.time(),
+            "last_run_finished": self.stats.get("last_run_finished"),
             "rows_processed": 0,
             "emails_saved": 0,
             "duplicates": 0,
             "failed": 0,
-        })
-        rows = self.supabase.get_unextracted_responses(limit=batch_size, offset=0) or []
+        }
+        self.stats = dict(stats)
+        if self.sql_extraction:
+            rows_processed, emails_saved = self.supabase.extract_emails_batch(batch_size * self.PARALLEL_BATCHES)
+            stats["rows_processed"] += rows_processed
+            stats["emails_saved"] += emails_saved
+            stats["last_run_finished"] = time.time()
+            self.stats = stats
+            return rows_processed >= batch_size * self.PARALLEL_BATCHES
+        # Pipeline: each keyset page is handed to the pool as soon as it is
+        # fetched, so fetching the next page overlaps extracting and saving
+        # the previous ones
+        futures = []
+        last_snapshot_id = None
+        backlog = False
+        with ThreadPoolExecutor(max_workers=self.PARALLEL_BATCHES) as executor:
+            while len(futures) < self.PARALLEL_BATCHES and not self._stop.is_set():
+                rows = self.supabase.get_unextracted_responses(limit=batch_size, after_snapshot_id=last_snapshot_id) or []
+                if rows:
+                    futures.append(executor.submit(self._process_batch, rows))
+                if len(rows) < batch_size:
+                    break
+                backlog = True
+                last_snapshot_id = rows[-1]["snapshot_id"]
+            for future in as_completed(futures):
+                for key, value in future.result().items():
+                    stats[key] += value
+                self.stats = dict(stats)
+        stats["last_run_finished"] = time.time()
+        self.stats = stats
+        # A full final page means more rows may be waiting; after failures the
+        # same rows would come straight back, so those wait for the interval
+        return backlog and len(futures) == self.PARALLEL_BATCHES and stats["failed"] == 0
+
+    def _process_batch(self, rows):
+        # Runs on a worker thread; returns counts merged into stats by run_once
+        counts = {"rows_processed": 0, "emails_saved": 0, "duplicates": 0, "failed": 0}
+        batch_emails = set()
+        extracted_ids = []
         for row in rows:
             if self._stop.is_set():
                 break
             snapshot_id = row.get("snapshot_id")
             response_data = row.get("response")
             try:
-                emails = extract_emails_from_json(response_data) if response_data else []
-                for email in emails:
-                    ok, err = self.supabase.save_email(email)
-                    if ok:
-                        self.stats["emails_saved"] += 1
-                    elif err == "duplicate":
-                        self.stats["duplicates"] += 1
-                    else:
-                        self.stats["failed"] += 1
-                        logger.error(f"Stage3 failed saving email {email}")
-                if self.supabase.mark_email_extracted(snapshot_id):
-                    self.stats["rows_processed"] += 1
-                else:
-                    self.stats["failed"] += 1
-                    logger.error(f"Stage3 failed marking extracted for {snapshot_id}")
+                if response_data:
+                    batch_emails |= extract_emails_from_json(response_data)
+                extracted_ids.append(snapshot_id)
             except Exception as e:
-                self.stats["failed"] += 1
+                counts["failed"] += 1
                 logger.exception(f"Stage3 error {snapshot_id}: {e}")
-            time.sleep(0.1)
-        self.stats["last_run_finished"] = time.time()
+
+        # Drop emails this process already saved, then one upsert for the rest;
+        # rows are only marked once it succeeded
+        with self._seen_lock:
+            new_emails = list(batch_emails - self._seen_emails)
+        saved, duplicates, failed = self.supabase.save_emails_bulk(new_emails)
+        counts["emails_saved"] += saved
+        counts["duplicates"] += duplicates + len(batch_emails) - len(new_emails)
+        if failed:
+            counts["failed"] += failed
+            logger.error(f"Stage3 failed saving {failed} emails; leaving batch unextracted")
+            return counts
+        with self._seen_lock:
+            if len(self._seen_emails) + len(new_emails) > self.SEEN_EMAILS_MAX:
+                self._seen_emails.clear()
+            self._seen_emails.update(new_emails)
+        if extracted_ids:
+            # One UPDATE ... IN for the batch instead of one request per row
+            if self.supabase.mark_emails_extracted_bulk(extracted_ids):
+                counts["rows_processed"] += len(extracted_ids)
+            else:
+                counts["failed"] += len(extracted_ids)
+                logger.error(f"Stage3 failed marking {len(extracted_ids)} rows extracted")
+        return counts
 
     def loop(self, interval_seconds: int = 30, batch_size: int = 20):
         logger.info("Stage3 server loop started")
         while not self._stop.is_set():
-            self.run_once(batch_size=batch_size)
-            for _ in range(interval_seconds):
-                if self._stop.is_set():
-                    break
-                time.sleep(1)
+            # Cleared before the run so a notify() arriving mid-run triggers another
+            self._wake.clear()
+            if self.run_once(batch_size=batch_size):
+                continue  # Backlog: keep draining without sleeping
+            # Idle: sleep until notified, with the interval as a fallback poll
+            if self._wake.wait(interval_seconds) and not self._stop.is_set():
+                self._stop.wait(self.WAKE_DEBOUNCE_SECONDS)
         logger.info("Stage3 server loop stopped")
 
+    def notify(self):
+        self._wake.set()
+
+    def health_body(self):
+        # Serialized once per published stats dict (run_once swaps rather than
+        # mutates it), so repeated polls between updates reuse the same bytes
+        stats, stop_requested = self.stats, self._stop.is_set()
+        cached = self._health_cache
+        if cached is None or cached[0] is not stats or cached[1] != stop_requested:
+            body = orjson.dumps({"status": "ok", "stats": stats, "stop_requested": stop_requested})
+            cached = self._health_cache = (stats, stop_requested, body)
+        return cached[2]
+
     def stop(self):
         self._stop.set()
+        self._wake.set()
 
 
 class Stage3Handler(BaseHTTPRequestHandler):
     service: Stage3Service = None  # injected
+    # Keep-alive: pollers reuse one connection instead of reconnecting per request
+    protocol_version = "HTTP/1.1"
 
     def _json(self, code: int, payload: dict):
+        self._send(code, orjson.dumps(payload))
+
+    def _send(self, code: int, body: bytes):
         self.send_response(code)
         self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
         self.end_headers()
-        self.wfile.write(json.dumps(payload).encode("utf-8"))
+        self.wfile.write(body)
 
     def do_GET(self):
         path = urlparse(self.path).path
         if path == "/health":
-            self._json(200, {
-                "status": "ok",
-                "stats": Stage3Handler.service.stats,
-                "stop_requested": Stage3Handler.service._stop.is_set(),
-            })
+            self._send(200, Stage3Handler.service.health_body())
         else:
             self._json(404, {"error": "not_found"})
 
     def do_POST(self):
+        # Drain any request body so the next request on this connection parses cleanly
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
         path = urlparse(self.path).path
         if path == "/run-once":
             threading.Thread(target=Stage3Handler.service.run_once, daemon=True).start()
             self._json(202, {"message": "run_once_started"})
+        elif path == "/notify":
+            Stage3Handler.service.notify()
+            self._json(202, {"message": "wakeup_queued"})
         elif path == "/stop":
             Stage3Handler.service.stop()
             self._json(200, {"message": "stopping"})
@@ -124,7 +204,8 @@ class Stage3Handler(BaseHTTPRequestHandler):
 def main(host: str = "0.0.0.0", port: int = 9003, interval: int = 30, batch_size: int = 20):
     service = Stage3Service()
     Stage3Handler.service = service
-    server = HTTPServer((host, port), Stage3Handler)
+    # One thread per request, so /health answers while /run-once is busy
+    server = ThreadingHTTPServer((host, port), Stage3Handler)
     loop_thread = threading.Thread(target=service.loop, args=(interval, batch_size), daemon=True)
     loop_thread.start()
     logger.info(f"Stage3 HTTP server on {host}:{port}")
@@ -1,11 +1,15 @@
 import os
-import time
 import logging
 import sys
-from typing import Optional, Dict, List
+import threading
+import time
+from typing import Optional, Dict, List, Set
 from dotenv import load_dotenv
 
-from email_scraper import BrightdataClient, SupabaseClient
+from email_scraper import BrightdataClient, SupabaseClient, TokenBucket, extract_emails_from_json
+
+# Seconds to wait for the stage loops to finish their current pass on Ctrl+C
+SHUTDOWN_TIMEOUT = 30
 
 
 def setup_logging():
@@ -29,19 +33,6 @@ def validate_env() -> tuple[bool, str]:
     return True, "ok"
 
 
-def extract_emails_from_text(text: str) -> List[str]:
-    import re
-    pattern = r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b"
-    emails = re.findall(pattern, text)
-    return list(set(emails))
-
-
-def extract_emails_from_json(json_data) -> List[str]:
-    import json
-    data_str = json.dumps(json_data)
-    return extract_emails_from_text(data_str)
-
-
 def process_stage2(bright: BrightdataClient, supa: SupabaseClient) -> Dict[str, int]:
     snapshots = supa.get_unprocessed_snapshots()
     total = len(snapshots) if snapshots else 0
@@ -87,8 +78,6 @@ def process_stage2(bright: BrightdataClient, supa: SupabaseClient) -> Dict[str,
             failed += 1
             logging.exception(f"Stage2 error for {snapshot_id}: {e}")
 
-        time.sleep(0.2)
-
     return {"total": total, "successful": successful, "failed": failed, "skipped": skipped}
 
 
@@ -98,42 +87,53 @@ def process_stage3(supa: SupabaseClient, batch_size: int = 20) -> Dict[str, int]
     total_failed = 0
     total_emails = 0
     total_duplicates = 0
+    seen_emails = set()  # lowercased emails saved this cycle (skip the round trip)
+    last_snapshot_id: Optional[str] = None
 
     while True:
-        rows = supa.get_unextracted_responses(limit=batch_size, offset=0)
+        # Keyset pagination: each page starts after the last snapshot_id seen,
+        # so rows that failed are not fetched again within this cycle
+        rows = supa.get_unextracted_responses(limit=batch_size, after_snapshot_id=last_snapshot_id)
         if not rows:
             break
+        last_snapshot_id = rows[-1]["snapshot_id"]
 
+        batch_emails: Set[str] = set()
+        extracted_ids: List[str] = []
         for row in rows:
             snapshot_id = row.get("snapshot_id")
             response_data = row.get("response")
+            total_processed += 1
             if not snapshot_id or response_data is None:
                 total_failed += 1
-                total_processed += 1
                 continue
 
             try:
-                emails = extract_emails_from_json(response_data)
-                if emails:
-                    for email in emails:
-                        ok, err = supa.save_email(email)
-                        if ok:
-                            total_emails += 1
-                        elif err == "duplicate":
-                            total_duplicates += 1
-
-                if supa.mark_email_extracted(snapshot_id):
-                    total_successful += 1
-                else:
-                    total_failed += 1
-
+                batch_emails |= extract_emails_from_json(response_data)
+                extracted_ids.append(snapshot_id)
             except Exception as e:
                 total_failed += 1
                 logging.exception(f"Stage3 error for {snapshot_id}: {e}")
 
-            total_processed += 1
+        # Drop emails already saved this cycle, then one upsert for the rest;
+        # rows are only marked once it succeeded
+        new_emails = list(batch_emails - seen_emails)
+        saved, duplicates, failed = supa.save_emails_bulk(new_emails)
+        total_emails += saved
+        total_duplicates += duplicates + len(batch_emails) - len(new_emails)
+        if failed:
+            total_failed += len(extracted_ids)
+            logging.error(f"Stage3 failed saving {failed} emails; stopping until next cycle")
+            break
+        seen_emails.update(new_emails)
 
-        time.sleep(0.2)
+        # One UPDATE ... IN for the batch instead of one request per row
+        if supa.mark_emails_extracted_bulk(extracted_ids):
+            total_successful += len(extracted_ids)
+        else:
+            total_failed += len(extracted_ids)
+            logging.error(f"Stage3 failed marking {len(extracted_ids)} rows extracted; stopping until next cycle")
+            break
 
     return {
         "total": total_processed,
@@ -144,6 +144,32 @@ def process_stage3(supa: SupabaseClient, batch_size: int = 20) -> Dict[str, int]
     }
 
 
+def stage2_loop(bright: BrightdataClient, supa: SupabaseClient, stop: threading.Event,
+                idle_sleep: int, responses_saved: threading.Event):
+    while not stop.is_set():
+        s2 = process_stage2(bright, supa)
+        logging.info(f"Stage2 total={s2['total']} ok={s2['successful']} skip={s2['skipped']} fail={s2['failed']}")
+        if s2["successful"]:
+            responses_saved.set()  # Wake Stage 3 instead of leaving it to its poll
+        stop.wait(idle_sleep if s2["total"] == 0 else 5)
+
+
+def stage3_loop(supa: SupabaseClient, stop: threading.Event, idle_sleep: int, responses_saved: threading.Event):
+    while not stop.is_set():
+        # Cleared before the pass so responses saved mid-pass trigger another
+        responses_saved.clear()
+        s3 = process_stage3(supa)
+        logging.info(
+            f"Stage3 total={s3['total']} ok={s3['successful']} fail={s3['failed']} "
+            f"emails={s3['emails']} dup={s3['duplicate_emails']}"
+        )
+        if s3["total"] == 0:
+            # Idle: sleep until Stage 2 saves responses, polling as a fallback
+            responses_saved.wait(idle_sleep)
+        else:
+            stop.wait(5)
+
+
 def main():
     load_dotenv()
     setup_logging()
@@ -158,25 +184,39 @@ def main():
     supabase_url = os.getenv("SUPABASE_URL", "")
     supabase_key = os.getenv("SUPABASE_KEY", "")
 
-    bright = BrightdataClient(api_key, brightdata_url)
+    # Brightdata downloads are paced by a token bucket (about the old 0.2s
+    # per snapshot), which only waits when requests actually come faster
+    bright = BrightdataClient(api_key, brightdata_url, rate_limiter=TokenBucket(5))
     supa = SupabaseClient(supabase_url, supabase_key)
 
     idle_sleep = int(os.getenv("WORKER_IDLE_SLEEP", "30"))
 
-    logging.info("Worker started: Stage 2 + Stage 3 loop")
-    while True:
-        s2 = process_stage2(bright, supa)
-        s3 = process_stage3(supa)
-
-        logging.info(
-            f"Stage2 total={s2['total']} ok={s2['successful']} skip={s2['skipped']} fail={s2['failed']} | "
-            f"Stage3 total={s3['total']} ok={s3['successful']} fail={s3['failed']} emails={s3['emails']} dup={s3['duplicate_emails']}"
-        )
-
-        if s2["total"] == 0 and s3["total"] == 0:
-            time.sleep(idle_sleep)
-        else:
-            time.sleep(5)
+    # Stage 2 waits on Brightdata and Stage 3 on Supabase, so they run in
+    # their own threads; Stage 3 drains responses while Stage 2 still fetches
+    stop = threading.Event()
+    responses_saved = threading.Event()
+    threads = [
+        threading.Thread(target=stage2_loop, args=(bright, supa, stop, idle_sleep, responses_saved), name="stage2", daemon=True),
+        threading.Thread(target=stage3_loop, args=(supa, stop, idle_sleep, responses_saved), name="stage3", daemon=True),
+    ]
+    logging.info("Worker started: Stage 2 + Stage 3 loops")
+    for thread in threads:
+        thread.start()
+    try:
+        # Short timed joins: an untimed join() may not see Ctrl+C on Windows
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(1)
+    except KeyboardInterrupt:
+        logging.info("Worker stopping")
+        stop.set()
+        responses_saved.set()
+        # Let in-flight Supabase writes finish, but don't hang on a stuck request
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        for thread in threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        if any(thread.is_alive() for thread in threads):
+            logging.warning(f"Worker loops still busy after {SHUTDOWN_TIMEOUT}s; exiting anyway")
 
 
 if __name__ == "__main__":